@@ -0,0 +1,103 @@
+"""
+Micro-batching of small concurrent MCQ requests under a synthetic load.
+
+Requests for 3-5 questions on different topics arrive as a Poisson stream
+against a stand-in with 300 ms base latency, a per-token charge and at most 8
+calls in flight, as a single key's quota allows. The same arrivals are served
+with batching off and with a few batch windows, and the benchmark reports
+upstream calls, p50 and p99 latency and how many callers fell back to an
+individual call, at a load one key serves comfortably and at one that saturates
+it. Run with `python benchmarks/bench_batching.py [requests] [per_second]`.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+from standin import import_server, reset_server  # noqa: E402
+
+server, standin = import_server()
+
+WINDOWS = (0.0, 0.05, 0.2)
+
+
+def mcq(topic: str, i: int) -> dict:
+    return {
+        "question": f"Question {i} about {topic}: which statement is true?", "answer": "The first one.",
+        "explanation": f"It follows from the definition of {topic}.",
+        "options": ["The first one.", "The second one.", "The third one.", "None of them."],
+    }
+
+
+def reply(prompt: str) -> str:
+    sets = re.findall(r"Set (\d+): (\d+) question\(s\)\. Topic: ([^.]+)\.", prompt)
+    if sets:
+        return json.dumps({"sets": [
+            {"set": int(index), "questions": [mcq(topic, i) for i in range(int(num))]} for index, num, topic in sets
+        ]})
+    topic = re.search(r"Topic: (.+)", prompt).group(1).strip()
+    return json.dumps({"questions": [mcq(topic, i) for i in range(int(re.search(r"Generate (\d+)", prompt).group(1)))]})
+
+
+def arrivals(requests: int, per_second: float, seed: int = 0) -> list[tuple[float, int]]:
+    """(offset in seconds, questions) for each request of a Poisson stream."""
+    rng = random.Random(seed)
+    offset = 0.0
+    stream = []
+    for _ in range(requests):
+        offset += rng.expovariate(per_second)
+        stream.append((offset, rng.randint(3, 5)))
+    return stream
+
+
+def percentile(seconds: list[float], p: float) -> float:
+    ordered = sorted(seconds)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def measure(window: float, stream: list[tuple[float, int]]) -> tuple[list[float], int, int]:
+    """(seconds per request, upstream calls, fallbacks) with batch window <window>."""
+    reset_server(server, max_concurrency=8)
+    server.mcq_batcher = server.MCQBatcher(window=window)
+    standin.reply = reply
+    standin.latency = 0.3
+    standin.seconds_per_token = 0.001
+
+    async def main() -> list[float]:
+        server.key_pool.warm_up()
+        began = time.perf_counter()
+
+        async def one(i: int, offset: float, num: int) -> float:
+            await asyncio.sleep(offset - (time.perf_counter() - began))
+            started = time.perf_counter()
+            questions = await server.generate_mcq_chunk(f"Topic {i}", "Beginner", num)
+            assert len(questions) == num and all(f"Topic {i}:" in q["question"] for q in questions)
+            return time.perf_counter() - started
+
+        return await asyncio.gather(*(one(i, offset, num) for i, (offset, num) in enumerate(stream)))
+
+    seconds = asyncio.run(main())
+    return seconds, standin.requests, server.mcq_batcher.fallbacks
+
+
+def main(requests: int = 300, *loads: int) -> None:
+    print(f"{requests} requests for 3-5 questions, 8 upstream calls in flight at most")
+    print(f"{'per second':>10}  {'window':>6}  {'upstream calls':>14}  {'p50':>7}  {'p99':>7}  {'fallbacks':>9}")
+    for per_second in loads or (12, 40):
+        stream = arrivals(requests, per_second)
+        for window in WINDOWS:
+            seconds, calls, fallbacks = measure(window, stream)
+            label = f"{window * 1000:.0f}ms" if window else "off"
+            print(
+                f"{per_second:>10}  {label:>6}  {calls:>14}  {percentile(seconds, 50) * 1000:5.0f}ms  "
+                f"{percentile(seconds, 99) * 1000:5.0f}ms  {fallbacks:>9}"
+            )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
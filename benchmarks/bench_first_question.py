@@ -0,0 +1,87 @@
+"""
+Time-to-first-question for streamed MCQs versus waiting for the whole response.
+
+The stand-in charges latency per output token and, when streaming, sends each
+part of the reply as soon as its tokens are "generated", as Gemini does. For
+each request size the benchmark reports how long create_mcqs takes to hand
+over the first question and all of them, with per-question streaming (what
+generate_mcqs does when the client sends a progress token) and without.
+Run with `python benchmarks/bench_first_question.py [seconds_per_token]`.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+from standin import import_server, reset_server  # noqa: E402
+
+server, standin = import_server()
+
+WORDS = (
+    "default argument keyword closure decorator generator lambda docstring return recursion nested global "
+    "nonlocal annotation partial yield mutable callback map sorted helper pure scope parameter positional "
+    "variadic unpacking iterator comprehension exception context manager signature call stack frame local"
+).split()
+ANSWER = "It is evaluated once, when the function is defined."
+EXPLANATION = (
+    "Python evaluates default values a single time at definition, so a mutable default is shared between "
+    "calls unless the function creates a fresh object on each call."
+)
+OPTIONS = [ANSWER, "It is evaluated on every call.", "It is never evaluated.", "It is evaluated at import only."]
+shuffler = random.Random(0)
+
+
+def reply(prompt: str) -> str:
+    num = int(re.search(r"Generate (\d+)", prompt).group(1))
+    # Random subject words keep every question distinct enough for the near-duplicate filter
+    return json.dumps({"questions": [
+        {"question": f"Which statement about {' '.join(shuffler.sample(WORDS, 6))} is true in Python?",
+         "answer": ANSWER, "explanation": EXPLANATION, "options": OPTIONS}
+        for _ in range(num)
+    ]})
+
+
+def measure(num: int, stream: bool, run: int) -> tuple[float, float]:
+    """(seconds to the first question, seconds to all <num>) for one request."""
+    first: list[float] = []
+
+    async def main() -> tuple[float, float]:
+        server.key_pool.warm_up()
+        started = time.perf_counter()
+
+        async def on_question(question: dict) -> None:
+            if not first:
+                first.append(time.perf_counter() - started)
+
+        questions = await server.create_mcqs(f"Functions{run}", "Beginner", num, on_question if stream else None)
+        total = time.perf_counter() - started
+        assert len(questions) == num
+        return (first[0] if stream else total), total
+
+    return asyncio.run(main())
+
+
+def main(seconds_per_token: float = 0.005) -> None:
+    print(f"stand-in: {seconds_per_token * 1000:g} ms per output token")
+    print(f"{'questions':>9}  {'whole response':>22}  {'streamed':>22}")
+    print(f"{'':>9}  {'first':>10}  {'all':>10}  {'first':>10}  {'all':>10}")
+    run = 0
+    for num in (5, 20, 40):
+        row = [f"{num:>9}"]
+        for stream in (False, True):
+            run += 1
+            reset_server(server)
+            standin.reply = reply
+            standin.seconds_per_token = seconds_per_token
+            first, total = measure(num, stream, run)
+            row.append(f"{first:9.2f}s  {total:9.2f}s")
+        print("  ".join(row))
+
+
+if __name__ == "__main__":
+    main(*map(float, sys.argv[1:2]))
@@ -0,0 +1,98 @@
+"""
+Flashcards from the compact question/answer schema versus cards derived from full MCQs.
+
+The stand-in model charges latency per output token (about 4 characters), as
+Gemini effectively does, and writes realistic cards or MCQs with four options
+and an explanation. For each deck size the benchmark reports output tokens and
+time-to-result for create_flashcards and for create_mcqs reduced to
+question/answer pairs, the path generate_flashcards used before.
+Run with `python benchmarks/bench_flashcards.py [seconds_per_token]`.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+from standin import import_server, reset_server  # noqa: E402
+
+server, standin = import_server()
+
+WORDS = (
+    "default argument keyword closure decorator generator lambda docstring return recursion nested global "
+    "nonlocal annotation partial yield mutable callback map sorted helper pure scope parameter positional "
+    "variadic unpacking iterator comprehension exception context manager signature call stack frame local "
+    "binding shadowing builtin namespace module import attribute method bound static class instance hash"
+).split()
+ANSWER = "It is evaluated once, when the function is defined."
+EXPLANATION = (
+    "Python evaluates default values a single time at definition, so a mutable default is shared between "
+    "calls unless the function creates a fresh object on each call."
+)
+OPTIONS = [ANSWER, "It is evaluated on every call.", "It is never evaluated.", "It is evaluated at import only."]
+shuffler = random.Random(0)
+
+
+def question() -> str:
+    # Random subject words keep every question distinct enough for the near-duplicate filter
+    return f"Which statement about {' '.join(shuffler.sample(WORDS, 6))} is true in Python?"
+
+
+output_tokens = 0
+
+
+def reply(prompt: str) -> str:
+    global output_tokens
+    num = int(re.search(r"(?:Write|Generate) (\d+)", prompt).group(1))
+    if "flashcards" in prompt:
+        text = json.dumps([{"question": question(), "answer": ANSWER} for i in range(num)])
+    else:
+        text = json.dumps({"questions": [
+            {"question": question(), "answer": ANSWER, "explanation": EXPLANATION, "options": OPTIONS}
+            for i in range(num)
+        ]})
+    output_tokens += len(text) // 4
+    return text
+
+
+async def from_mcqs(topic: str, level: str, num: int) -> list[dict]:
+    """Cards cut down from full MCQs, as generate_flashcards made them before."""
+    return [{"question": q["question"], "answer": q["answer"]} for q in await server.create_mcqs(topic, level, num)]
+
+
+def measure(create, num: int, run: int) -> tuple[int, float]:
+    """(output tokens, seconds) for one deck of <num> cards."""
+    global output_tokens
+    output_tokens = 0
+
+    async def main() -> float:
+        server.key_pool.warm_up()
+        started = time.perf_counter()
+        cards = await create(f"Functions{run}", "Beginner", num)
+        assert len(cards) == num and set(cards[0]) == {"question", "answer"}
+        return time.perf_counter() - started
+
+    seconds = asyncio.run(main())
+    return output_tokens, seconds
+
+
+def main(seconds_per_token: float = 0.005) -> None:
+    print(f"stand-in: {seconds_per_token * 1000:g} ms per output token")
+    print(f"{'cards':>5}  {'compact schema':>22}  {'derived from MCQs':>22}")
+    for run, num in enumerate((5, 10, 20)):
+        row = [f"{num:>5}"]
+        for create in (server.create_flashcards, from_mcqs):
+            reset_server(server)
+            standin.reply = reply
+            standin.seconds_per_token = seconds_per_token
+            tokens, seconds = measure(create, num, run)
+            row.append(f"{tokens:>6} tokens {seconds:6.2f}s".rjust(22))
+        print("  ".join(row))
+
+
+if __name__ == "__main__":
+    main(*map(float, sys.argv[1:2]))
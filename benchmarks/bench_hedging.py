@@ -0,0 +1,90 @@
+"""
+Hedged MCQ requests under heavy-tailed latency.
+
+The stand-in answers most requests in 50-100 ms, but one in <tail> stalls for
+a full second, as an overloaded Gemini replica does. The benchmark sends the
+same stream of MCQ requests with hedging off and at the 95th percentile with a
+10% budget, and reports p50, p99 and the extra upstream calls hedging cost.
+Run with `python benchmarks/bench_hedging.py [requests] [tail]`.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+from standin import import_server, reset_server  # noqa: E402
+
+server, standin = import_server()
+
+CONCURRENCY = 8
+SIZES = (1, 2, 5)
+
+
+def heavy_tailed(tail: int, seed: int = 0):
+    """Stand-in reply that sleeps 50-100 ms, or a full second for one request in <tail>."""
+    rng = random.Random(seed)
+
+    def reply(prompt: str) -> str:
+        time.sleep(1.0 if rng.randrange(tail) == 0 else rng.uniform(0.05, 0.1))
+        num = int(re.search(r"Generate (\d+)", prompt).group(1))
+        return json.dumps({"questions": [
+            {"question": f"Question {i}?", "answer": "A", "explanation": "Because.", "options": ["A", "B", "C", "D"]}
+            for i in range(num)
+        ]})
+
+    return reply
+
+
+def percentile(seconds: list[float], p: float) -> float:
+    ordered = sorted(seconds)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def measure(hedger, requests: int, tail: int) -> tuple[list[float], int]:
+    """(seconds per request, upstream calls) for <requests> MCQ requests of mixed sizes."""
+    reset_server(server, max_concurrency=2 * CONCURRENCY)
+    standin.reply = heavy_tailed(tail)
+
+    async def main() -> list[float]:
+        server.key_pool.warm_up()
+        slots = asyncio.Semaphore(CONCURRENCY)
+
+        async def one(i: int) -> float:
+            num = SIZES[i % len(SIZES)]
+            async with slots:
+                started = time.perf_counter()
+                questions = await hedger.run(num, lambda: server.request_mcqs(f"Topic {i}", "Beginner", num))
+                assert len(questions) == num
+                return time.perf_counter() - started
+
+        # Fill every size bucket before measuring, so hedging is active from the first timed request
+        await asyncio.gather(*(one(i) for i in range(hedger.min_samples * len(SIZES))))
+        standin.requests = 0
+        return await asyncio.gather(*(one(i) for i in range(requests)))
+
+    seconds = asyncio.run(main())
+    return seconds, standin.requests
+
+
+def main(requests: int = 300, tail: int = 50) -> None:
+    print(f"{requests} requests of {SIZES} questions, {CONCURRENCY} at a time; 1 in {tail} stalls for 1s")
+    print(f"{'':>16}  {'p50':>7}  {'p99':>7}  {'mean':>7}  {'upstream calls':>14}")
+    for label, hedger in (
+        ("no hedging", server.RequestHedger(percentile=0)),
+        ("hedge at p95", server.RequestHedger(percentile=95, budget=0.1)),
+    ):
+        seconds, calls = measure(hedger, requests, tail)
+        print(
+            f"{label:>16}  {percentile(seconds, 50) * 1000:5.0f}ms  {percentile(seconds, 99) * 1000:5.0f}ms  "
+            f"{statistics.mean(seconds) * 1000:5.0f}ms  {calls:>6} (+{calls / requests - 1:.0%})"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
@@ -0,0 +1,72 @@
+"""
+Microbenchmark for clean_and_parse_json.
+
+Times the current single-pass parser against the chained str.replace cleaner it
+replaced, on every case in tests/json_repair_corpus plus the saved responses
+res2.txt and res2.json. It also reports whether each one parses to the expected
+value. Run with `python benchmarks/bench_json_repair.py [repeats]`.
+"""
+import ast
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+from standin import import_server  # noqa: E402
+from test_json_repair import corpus, read  # noqa: E402
+
+server, _ = import_server()
+
+
+def chained_replace(json_string):
+    """The cleaner clean_and_parse_json used before, kept here for comparison."""
+    cleaned_string = json_string.replace("'''", " ") \
+                                .replace('"""', " ") \
+                                .replace('```', " ") \
+                                .replace('`', " ") \
+                                .replace('**', " ") \
+                                .replace('*', " ") \
+                                .replace('\\n', ' ') \
+                                .replace('\\t', ' ') \
+                                .replace('\\"', '"') \
+                                .replace("\\'", "'")\
+                                .replace('\n', ' ') \
+                                .replace('\t', ' ') \
+                                .replace('\"', '"') \
+                                .replace("\'", "'")\
+                                .replace('\\', ' ').strip()
+    return json.loads(cleaned_string)
+
+
+def cases():
+    yield from corpus()
+    text = read("res2.txt")
+    yield "res2.txt", text, ast.literal_eval(text)
+    text = read("res2.json")
+    yield "res2.json (fenced)", f"```json\n{text}\n```", json.loads(text)
+
+
+def measure(parse, text, expected, repeats):
+    """(microseconds per call, parsed correctly)"""
+    try:
+        correct = parse(text) == expected
+    except ValueError:  # json.JSONDecodeError included
+        return None, False
+    return min(timeit.repeat(lambda: parse(text), number=repeats, repeat=5)) / repeats * 1e6, correct
+
+
+def main(repeats: int = 200) -> None:
+    print(f"{'case':<32}{'bytes':>7}  {'single-pass':>16}  {'chained replace':>18}")
+    for name, text, expected in cases():
+        row = [f"{name:<32}{len(text):>7}"]
+        for parse, width in ((server.clean_and_parse_json, 16), (chained_replace, 18)):
+            micros, correct = measure(parse, text, expected, repeats)
+            cell = "error" if micros is None else f"{micros:.1f}us {'ok' if correct else 'WRONG'}"
+            row.append(f"{cell:>{width}}")
+        print("  ".join(row))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
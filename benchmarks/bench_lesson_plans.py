@@ -0,0 +1,98 @@
+"""
+Lesson plans generated in one piece versus as six sections in parallel.
+
+The stand-in charges latency per output token and gets each list in its
+output wrong with probability <defect_rate> (written as a bare string, which
+no JSON repair can fix), whether it writes the whole plan or a single section.
+The benchmark generates the same plans with create_lesson_plan and
+create_sectioned_lesson_plan and reports median and worst latency and the
+share that came back as the template.
+Run with `python benchmarks/bench_lesson_plans.py [plans] [defect_percent]`.
+"""
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+from standin import import_server, reset_server  # noqa: E402
+
+server, standin = import_server()
+
+CONCURRENCY = 4
+PHASES = ("introduction", "main_content", "conclusion", "assessment")
+
+
+def stand_in(defect_rate: float, seed: int = 0):
+    """Stand-in reply for the whole plan or any one section, each list defective with <defect_rate>."""
+    rng = random.Random(seed)
+
+    def items(kind: str) -> list[str] | str:
+        values = [f"{kind.capitalize()} {i}: a concrete, classroom-ready {kind} for this lesson" for i in range(4)]
+        return "See above" if rng.random() < defect_rate else values
+
+    def foundations() -> dict:
+        return {"title": "Photosynthesis in Plants", "learning_objectives": items("objective"), "materials_needed": items("material")}
+
+    def phase(name: str) -> dict:
+        return {"duration": "10 minutes", "activities": items(f"{name.replace('_', ' ')} activity")}
+
+    def follow_up() -> dict:
+        return {"key_concepts": items("concept"), "homework_assignment": "Label the parts of a leaf and explain each.",
+                "additional_resources": ["Textbook chapter 4", "Leaf anatomy video"]}
+
+    def reply(prompt: str) -> str:
+        if "Create a detailed lesson plan" in prompt:
+            return json.dumps({
+                **foundations(), "topic": "Photosynthesis", "grade_level": "Middle School", "duration": "60 minutes",
+                "lesson_structure": {name: phase(name) for name in PHASES}, **follow_up(),
+            })
+        if "learning objectives" in prompt:
+            return json.dumps(foundations())
+        if "key concepts" in prompt:
+            return json.dumps(follow_up())
+        return json.dumps(phase(next(name for name in PHASES if name.replace("_", " ") in prompt)))
+
+    return reply
+
+
+def measure(create, plans: int, defect_rate: float) -> tuple[list[float], int, int]:
+    """(seconds per plan, plans that fell back to the template, upstream calls)."""
+    reset_server(server, max_concurrency=8 * CONCURRENCY)
+    standin.reply = stand_in(defect_rate)
+    standin.seconds_per_token = 0.005
+
+    async def main() -> list[float]:
+        server.key_pool.warm_up()
+        slots = asyncio.Semaphore(CONCURRENCY)
+
+        async def one(i: int) -> float:
+            async with slots:
+                started = time.perf_counter()
+                await create(f"Photosynthesis {i}", "Middle School", 60)
+                return time.perf_counter() - started
+
+        return await asyncio.gather(*(one(i) for i in range(plans)))
+
+    seconds = asyncio.run(main())
+    outcomes = server.lesson_plan_outcomes
+    return seconds, outcomes["fallback"] + outcomes["failed"], standin.requests
+
+
+def main(plans: int = 40, defect_percent: int = 5) -> None:
+    print(f"{plans} plans, {CONCURRENCY} at a time; each list defective with {defect_percent}% probability")
+    print(f"{'':>10}  {'median':>7}  {'worst':>7}  {'template':>9}  {'upstream calls':>14}")
+    for label, create in (("monolithic", server.create_lesson_plan), ("sectioned", server.create_sectioned_lesson_plan)):
+        seconds, fallbacks, calls = measure(create, plans, defect_percent / 100)
+        print(
+            f"{label:>10}  {statistics.median(seconds):6.2f}s  {max(seconds):6.2f}s  "
+            f"{fallbacks / plans:>9.0%}  {calls:>14}"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
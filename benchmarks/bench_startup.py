@@ -0,0 +1,81 @@
+"""
+Server startup: time from spawning the process to an answered tools/list.
+
+Launches the server over stdio the way an MCP client does, several times, and
+reports the median time to `initialize` and to `tools/list`. For comparison it
+times importing the heavy libraries the server used to load at startup (now
+imported lazily), and lists the slowest imports that remain on the startup
+path from `python -X importtime`. Run with `python benchmarks/bench_startup.py [runs]`.
+"""
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER = os.path.join(ROOT, "educhain_mcp_server_final.py")
+LAZY_IMPORTS = "import educhain, langchain_google_genai, google.genai"
+
+
+def environment(scratch: str) -> dict:
+    return {
+        **os.environ,
+        "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY") or "test-key",
+        "EDUCHAIN_BANK_PATH": os.path.join(scratch, "question_bank.sqlite3"),
+        "EDUCHAIN_JOBS_PATH": os.path.join(scratch, "generation_jobs.sqlite3"),
+    }
+
+
+async def time_to_tools_list(env: dict) -> tuple[float, float]:
+    """(seconds to initialize, seconds to tools/list) for one fresh server process."""
+    started = time.perf_counter()
+    params = StdioServerParameters(command=sys.executable, args=[SERVER], env=env, cwd=ROOT)
+    with open(os.devnull, "w") as server_log:
+        async with stdio_client(params, errlog=server_log) as (read, write):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                initialized = time.perf_counter() - started
+                await session.list_tools()
+                return initialized, time.perf_counter() - started
+
+
+def import_seconds(statement: str, env: dict) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", statement], env=env, cwd=ROOT, check=True)
+    return time.perf_counter() - started
+
+
+def slowest_imports(env: dict, count: int = 10) -> list[tuple[int, str]]:
+    """(cumulative microseconds, module) for the slowest imports when loading the server module."""
+    profile = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import educhain_mcp_server_final"],
+        env=env, cwd=ROOT, capture_output=True, text=True, check=True,
+    ).stderr
+    slowest: dict[str, int] = {}
+    for line in profile.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            _, cumulative, module = line.split("|")
+            slowest[module.strip()] = max(slowest.get(module.strip(), 0), int(cumulative))
+    return sorted(((micros, module) for module, micros in slowest.items()), reverse=True)[:count]
+
+
+def main(runs: int = 5) -> None:
+    with tempfile.TemporaryDirectory() as scratch:
+        env = environment(scratch)
+        timings = [asyncio.run(time_to_tools_list(env)) for _ in range(runs)]
+        print(f"initialize  median {statistics.median(t[0] for t in timings):.2f}s over {runs} runs")
+        print(f"tools/list  median {statistics.median(t[1] for t in timings):.2f}s over {runs} runs")
+        print(f"python -c '{LAZY_IMPORTS}': {import_seconds(LAZY_IMPORTS, env):.2f}s (no longer paid at startup)")
+        print("slowest imports at startup (cumulative):")
+        for micros, module in slowest_imports(env):
+            print(f"  {micros / 1e6:6.2f}s  {module}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,54 @@
+"""
+Per-call overhead of the Gemini transport against a local HTTP stand-in.
+
+Compares building a fresh genai.Client for every call, as get_gemini_response
+used to, with the server's shared, pooled transport. The stand-in answers
+instantly, so the time per call is all client-side overhead, and its
+connection counter shows how many TCP connections each approach opened. A
+real endpoint adds a TLS handshake to every new connection on top of this.
+Run with `python benchmarks/bench_transport.py [calls]`.
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+
+from standin import import_server, reset_server  # noqa: E402
+
+server, standin = import_server()
+
+
+def per_call_client(calls: int) -> float:
+    from google import genai
+    from google.genai import types
+
+    started = time.perf_counter()
+    for _ in range(calls):
+        client = genai.Client(api_key="test-key", http_options=types.HttpOptions(base_url=standin.base_url))
+        client.models.generate_content(model=server.GEMINI_MODEL, contents="hi")
+    return time.perf_counter() - started
+
+
+def shared_transport(calls: int) -> float:
+    async def main() -> float:
+        server.key_pool.warm_up()
+        started = time.perf_counter()
+        for _ in range(calls):
+            await server.get_gemini_response("hi")
+        return time.perf_counter() - started
+
+    return asyncio.run(main())
+
+
+def main(calls: int = 50) -> None:
+    per_call_client(1)  # imports are not part of the comparison
+    for name, run in (("per-call genai.Client", per_call_client), ("shared transport", shared_transport)):
+        reset_server(server)
+        elapsed = run(calls)
+        print(f"{name:<22} {elapsed / calls * 1000:7.2f} ms/call  {standin.connections:3d} TCP connections for {calls} calls")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:2]))
@@ -1,262 +1,2907 @@
 import os
+import re
+import copy
+import functools
+import operator
+import bisect
 import json
-from google import genai
-from typing import Dict, Any
+import time
+import uuid
+import hashlib
+import sqlite3
+import asyncio
+import threading
+import contextvars
+import httpx
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Any, Callable, Awaitable, Iterator
+from pydantic import BaseModel, TypeAdapter, create_model
 from dotenv import load_dotenv
-from mcp.server.fastmcp import FastMCP
-from educhain import Educhain, LLMConfig
-from langchain_google_genai import ChatGoogleGenerativeAI
+from mcp.server.fastmcp import FastMCP, Context
+
+# google.genai, educhain and langchain_google_genai are imported lazily by
+# GeminiTransport: together they take several seconds to import, and the
+# server must answer initialize/tools/list before any of them is needed.
 
 load_dotenv()
 
-# Initialize Educhain client with Gemini
-client = Educhain(
-    LLMConfig(
-        custom_model=ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash", google_api_key=os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = "gemini-2.5-flash"
+# "educhain" generates MCQs through Educhain's LangChain engine; "direct" serves
+# every tool through the genai client alone and never imports LangChain.
+MODEL_BACKEND = os.getenv("EDUCHAIN_BACKEND", "educhain").lower()
+
+class GeminiTransport:
+    """
+    Long-lived Gemini clients for one API key, shared by every tool call.
+
+    Both the direct genai path and the Educhain engine are built once, on first
+    use or by the background warm-up, so that imports, auth setup and TCP/TLS
+    handshakes are paid once and subsequent calls reuse warm keep-alive
+    connections.
+
+    Args:
+        api_key (str): Gemini API key used by both clients.
+        base_url (str, optional): Override for the Gemini endpoint, e.g. a local stand-in.
+        max_connections (int): Size of the HTTP connection pool.
+        request_timeout (float): Seconds any single HTTP request may take; this
+            also bounds Educhain calls, which cannot be cancelled once running.
+    """
+
+    def __init__(
+        self, api_key: str | None, base_url: str | None = None, max_connections: int = 10,
+        request_timeout: float = 120.0,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.request_timeout = request_timeout
+        self._clients: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _build_genai(self):
+        from google import genai
+        from google.genai import types
+
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections,
+            keepalive_expiry=120,
         )
-    )
+        # Passing explicit httpx transports also keeps genai off its aiohttp
+        # path, which opens a fresh session (and connection) for every request.
+        return genai.Client(
+            api_key=self.api_key,
+            http_options=types.HttpOptions(
+                base_url=self.base_url,
+                timeout=int(self.request_timeout * 1000),
+                client_args={"transport": httpx.HTTPTransport(limits=limits)},
+                async_client_args={"transport": httpx.AsyncHTTPTransport(limits=limits)},
+            ),
+        )
+
+    def _build_educhain(self):
+        from educhain import Educhain, LLMConfig
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        # The LangChain model keeps its own channel open for the life of the
+        # process; it only needs the REST transport when pointed at a stand-in.
+        chat_options = {"transport": "rest", "client_options": {"api_endpoint": self.base_url}} if self.base_url else {}
+        return Educhain(
+            LLMConfig(
+                custom_model=ChatGoogleGenerativeAI(
+                    model=GEMINI_MODEL, google_api_key=self.api_key, timeout=self.request_timeout, **chat_options
+                )
+            )
+        )
+
+    def client(self, name: str) -> Any:
+        """Return the "genai" or "educhain" client, building it (blocking) on first use."""
+        if name not in self._clients:
+            with self._lock:
+                if name not in self._clients:
+                    self._clients[name] = getattr(self, f"_build_{name}")()
+        return self._clients[name]
+
+    async def ensure(self, name: str) -> None:
+        """Build a client on a worker thread so the event loop never blocks on imports."""
+        if name not in self._clients:
+            await asyncio.to_thread(self.client, name)
+
+    @property
+    def genai(self):
+        return self.client("genai")
+
+    @property
+    def educhain(self):
+        return self.client("educhain")
+
+    def warm_up(self) -> None:
+        """Import and build the clients the configured backend needs ahead of the first tool call."""
+        for name in ("genai",) if MODEL_BACKEND == "direct" else ("genai", "educhain"):
+            self.client(name)
+
+# GEMINI_API_KEYS (comma-separated) spreads calls over several keys or projects
+API_KEYS = list(dict.fromkeys(
+    key.strip() for key in (os.getenv("GEMINI_API_KEYS") or os.getenv("GEMINI_API_KEY") or "").split(",") if key.strip()
+)) or [None]
+
+# Upper bound on model calls in flight at once per key; further tool calls wait for a slot
+MAX_CONCURRENT_GENERATIONS = int(os.getenv("EDUCHAIN_MAX_CONCURRENCY", "4"))
+# Blocking engine calls get their own threads: the default executor is sized
+# from the CPU count and would cap concurrency well below the slot limit.
+_generation_threads = ThreadPoolExecutor(MAX_CONCURRENT_GENERATIONS * len(API_KEYS), thread_name_prefix="educhain")
+
+def is_rate_limited(error: Exception) -> bool:
+    """Whether <error> is a quota rejection (HTTP 429) from genai, LangChain or the Google API core."""
+    if 429 in (getattr(error, "code", None), getattr(error, "status_code", None)):
+        return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message
+
+class AdaptiveLimiter:
+    """
+    Admission control for the upstream model calls made with one API key.
+
+    KeyPool waits on the shared <condition> until admission_delay() reports
+    that a call may start, counts it with admit() and runs it with run().
+    Calls are admitted only while requests-per-minute and tokens-per-minute
+    token buckets have budget and fewer than <limit> calls are in flight.
+    The buckets refill continuously and hold BURST_SECONDS worth of budget,
+    so a burst is spread out instead of spending the whole minute at once.
+    The limit follows AIMD: it grows by 1/limit after each healthy call up to
+    <max_concurrency> and halves after a 429 or a latency spike (at most once
+    per typical call duration). Spikes are judged on seconds per token, so
+    only calls whose response reports token usage take part.
+
+    Args:
+        max_concurrency (int): Ceiling for calls in flight.
+        rpm (int): Requests per minute, 0 for no limit.
+        tpm (int): Tokens per minute, 0 for no limit.
+        tokens_per_call (int): Token estimate charged up front; corrected from
+            the response's usage metadata when available.
+        spike_factor (float): Seconds per token above this multiple of the
+            running average count as a spike.
+        condition (asyncio.Condition, optional): Notified whenever a call
+            finishes; KeyPool passes one shared condition so it can wait on
+            every key's limiter at once.
+    """
+
+    BURST_SECONDS = 10
+
+    def __init__(
+        self, max_concurrency: int, rpm: int = 0, tpm: int = 0, tokens_per_call: int = 2000,
+        spike_factor: float = 3.0, condition: asyncio.Condition | None = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.rpm = rpm
+        self.tpm = tpm
+        self.tokens_per_call = tokens_per_call
+        self.spike_factor = spike_factor
+        self.request_capacity = max(1.0, rpm * self.BURST_SECONDS / 60)
+        self.token_capacity = max(1.0, tpm * self.BURST_SECONDS / 60)
+        self.request_budget = self.request_capacity
+        self.token_budget = self.token_capacity
+        self.in_flight = 0
+        self.average_latency: float | None = None
+        self.seconds_per_token: float | None = None
+        self.blocked_until = 0.0
+        self.rate_limited = 0
+        self.latency_spikes = 0
+        self._refilled = time.monotonic()
+        self._last_decrease = 0.0
+        self._changed = condition or asyncio.Condition()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._refilled
+        self._refilled = now
+        if self.rpm:
+            self.request_budget = min(self.request_capacity, self.request_budget + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.token_budget = min(self.token_capacity, self.token_budget + elapsed * self.tpm / 60)
+
+    def admission_delay(self, tokens: int) -> float | None:
+        """Seconds until a call could be admitted on budget alone, or None if the concurrency limit is the blocker."""
+        now = time.monotonic()
+        self._refill(now)
+        if self.in_flight >= int(self.limit):
+            return None
+        delay = self.blocked_until - now
+        if self.rpm and self.request_budget < 1:
+            delay = max(delay, (1 - self.request_budget) * 60 / self.rpm)
+        needed = min(tokens, self.token_capacity)
+        if self.tpm and self.token_budget < needed:
+            delay = max(delay, (needed - self.token_budget) * 60 / self.tpm)
+        return max(0.0, delay)
+
+    def admit(self, tokens: int) -> None:
+        """Count a call as in flight and charge it to the budgets; callers check admission_delay first."""
+        self.in_flight += 1
+        if self.rpm:
+            self.request_budget -= 1
+        if self.tpm:
+            self.token_budget -= tokens
+
+    async def _release(self, tokens: int, used: int | None, latency: float, rate_limited: bool) -> None:
+        async with self._changed:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if self.tpm and used is not None:
+                self.token_budget -= used - tokens
+            per_token = latency / used if used else None
+            spike = (
+                per_token is not None and self.seconds_per_token is not None
+                and per_token > self.spike_factor * self.seconds_per_token
+            )
+            if rate_limited or spike:
+                self.rate_limited += rate_limited
+                self.latency_spikes += spike
+                if now - self._last_decrease > (self.average_latency or 1.0):
+                    self.limit = max(1.0, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            if not rate_limited:
+                self.average_latency = latency if self.average_latency is None else 0.8 * self.average_latency + 0.2 * latency
+            if per_token is not None:
+                self.seconds_per_token = (
+                    per_token if self.seconds_per_token is None else 0.8 * self.seconds_per_token + 0.2 * per_token
+                )
+            self._changed.notify_all()
+
+    async def run(self, attempt: Callable[[], Awaitable[Any]], tokens: int | None = None) -> Any:
+        """
+        Run one already admitted <attempt>, then release its slot; a 429 shrinks
+        the concurrency limit and is re-raised.
+        """
+        tokens = tokens or self.tokens_per_call
+        started = time.monotonic()
+        try:
+            result = await attempt()
+        except BaseException as e:
+            limited = isinstance(e, Exception) and is_rate_limited(e)
+            await self._release(tokens, None, time.monotonic() - started, limited)
+            raise
+        usage = getattr(result, "usage_metadata", None)
+        await self._release(tokens, getattr(usage, "total_token_count", None), time.monotonic() - started, False)
+        return result
+
+    def pause(self, seconds: float) -> None:
+        """Admit nothing for the next <seconds>."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """Limiter state for the metrics tool."""
+        self._refill(time.monotonic())
+        return {
+            "concurrency_limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "requests_available": round(self.request_budget, 1) if self.rpm else None,
+            "tokens_available": round(self.token_budget) if self.tpm else None,
+            "paused_seconds": round(max(0.0, self.blocked_until - time.monotonic()), 1),
+            "rate_limited": self.rate_limited,
+            "latency_spikes": self.latency_spikes,
+        }
+
+class KeyPool:
+    """
+    Spreads model calls across one or more Gemini API keys.
+
+    Every key has its own GeminiTransport and AdaptiveLimiter, so quotas and
+    concurrency are tracked per key. Each call goes to the least-loaded key
+    that can admit it soonest. A key that answers 429 is taken out of rotation
+    for a cooldown that doubles with each consecutive quota error (up to a
+    minute) and resets after a success; the call itself is not failed but
+    queued again on the best remaining key.
+
+    Args:
+        api_keys (list): One entry per key; None uses the client's own defaults.
+        base_url, max_connections, request_timeout: Passed to each key's GeminiTransport.
+        retries (int): Rate-limited retries per call before the error is raised.
+        **limits: max_concurrency, rpm, tpm and tokens_per_call, applied per key.
+    """
+
+    def __init__(
+        self, api_keys: list[str | None], base_url: str | None = None, max_connections: int = 10,
+        request_timeout: float = 120.0, retries: int = 8, **limits: Any,
+    ):
+        self.api_keys = api_keys
+        self.transports = [GeminiTransport(key, base_url, max_connections, request_timeout) for key in api_keys]
+        self._changed = asyncio.Condition()
+        self.limiters = [AdaptiveLimiter(**limits, condition=self._changed) for _ in api_keys]
+        self.retries = retries
+        self.strikes = [0] * len(api_keys)
+        self.calls = [0] * len(api_keys)
+
+    async def _admit(self) -> int:
+        """Wait until some key can admit a call, admit it on the least loaded such key and return its index."""
+        async with self._changed:
+            while True:
+                delays = [limiter.admission_delay(limiter.tokens_per_call) for limiter in self.limiters]
+                ready = [index for index, delay in enumerate(delays) if delay == 0]
+                if ready:
+                    index = min(ready, key=lambda index: self.limiters[index].in_flight / self.limiters[index].limit)
+                    self.limiters[index].admit(self.limiters[index].tokens_per_call)
+                    return index
+                # None means a key is at its concurrency limit and frees up when a call finishes
+                timed = [delay for delay in delays if delay is not None]
+                try:
+                    await asyncio.wait_for(self._changed.wait(), min(timed) if timed else None)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run(self, call: Callable[[GeminiTransport], Any], client: str) -> Any:
+        """Run <call> on the best key, moving to another key after a 429."""
+        for transport in self.transports:
+            await transport.ensure(client)
+        for retry in range(self.retries + 1):
+            index = await self._admit()
+            transport, limiter = self.transports[index], self.limiters[index]
+
+            async def attempt() -> Any:
+                if client == "educhain":
+                    loop = asyncio.get_running_loop()
+                    return await loop.run_in_executor(_generation_threads, call, transport)
+                return await call(transport)
+
+            self.calls[index] += 1
+            try:
+                result = await limiter.run(attempt)
+            except Exception as e:
+                if not is_rate_limited(e) or retry == self.retries:
+                    raise
+                self.strikes[index] += 1
+                limiter.pause(min(60.0, 2.0 ** (self.strikes[index] - 1)))
+                continue
+            self.strikes[index] = 0
+            return result
+
+    def warm_up(self) -> None:
+        """Build every key's clients ahead of the first tool call."""
+        for transport in self.transports:
+            transport.warm_up()
+
+    def stats(self) -> list[Dict[str, Any]]:
+        """Per-key health and limiter state for the metrics tool; keys are shown by their last four characters."""
+        return [
+            {
+                "key": f"...{key[-4:]}" if key else None,
+                "calls": calls,
+                "consecutive_quota_errors": strikes,
+                **limiter.stats(),
+            }
+            for key, calls, strikes, limiter in zip(self.api_keys, self.calls, self.strikes, self.limiters)
+        ]
+
+key_pool = KeyPool(
+    API_KEYS,
+    base_url=os.getenv("GEMINI_BASE_URL") or None,
+    max_connections=int(os.getenv("EDUCHAIN_MAX_CONNECTIONS", "10")),
+    request_timeout=float(os.getenv("EDUCHAIN_REQUEST_TIMEOUT_SECONDS", "120")),
+    max_concurrency=MAX_CONCURRENT_GENERATIONS,
+    rpm=int(os.getenv("EDUCHAIN_RPM", "0")),
+    tpm=int(os.getenv("EDUCHAIN_TPM", "0")),
+    tokens_per_call=int(os.getenv("EDUCHAIN_TOKENS_PER_CALL", "2000")),
+)
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling Gemini while the circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    Fails model calls fast while Gemini is erroring or unusually slow.
+
+    Outcomes of the last <window> calls are kept; a call fails if it raises or
+    takes longer than <slow_seconds>. Once at least <min_calls> outcomes are
+    known and the failure share reaches <failure_rate>, the breaker opens and
+    every call raises CircuitOpenError for <cooldown> seconds. After that one
+    probe call is let through: success closes the breaker, failure reopens it.
+
+    Args:
+        failure_rate (float): Failure share that opens the breaker.
+        slow_seconds (float): Calls slower than this count as failures; only the
+            upstream request is timed, not the wait for rate-limiter admission.
+        window (int): Number of recent outcomes considered.
+        min_calls (int): Outcomes needed before the breaker may open.
+        cooldown (float): Seconds to stay open before probing.
+    """
+
+    def __init__(
+        self, failure_rate: float = 0.5, slow_seconds: float = 45.0, window: int = 20,
+        min_calls: int = 5, cooldown: float = 30.0,
+    ):
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.outcomes: deque[bool] = deque(maxlen=window)  # True = failed
+        self.opened_at: float | None = None
+        self.probing = False
+        self.opens = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.cooldown else "half_open"
+
+    def before_call(self) -> bool:
+        """Admit a call or raise CircuitOpenError. Returns whether the call is the half-open probe."""
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        self.rejected += 1
+        raise CircuitOpenError("Gemini is currently unavailable (circuit breaker open)")
+
+    def record(self, failed: bool, probe: bool) -> None:
+        """Feed back one call outcome."""
+        if probe:
+            self.probing = False
+            self.outcomes.clear()
+            if failed:
+                self.opened_at = time.monotonic()
+                self.opens += 1
+            else:
+                self.opened_at = None
+            return
+        if self.opened_at is not None:
+            return  # a call admitted before the breaker opened
+        self.outcomes.append(failed)
+        if len(self.outcomes) >= self.min_calls and sum(self.outcomes) / len(self.outcomes) >= self.failure_rate:
+            self.opened_at = time.monotonic()
+            self.opens += 1
+            self.outcomes.clear()
+
+    def abandon(self, probe: bool) -> None:
+        """Forget a call that ended without a verdict (cancelled or cut short by the caller's deadline)."""
+        if probe:
+            self.probing = False
+
+    async def recovered(self) -> None:
+        """Wait until the breaker would let a call through again."""
+        while True:
+            state = self.state
+            if state == "closed" or (state == "half_open" and not self.probing):
+                return
+            if state == "open":
+                await asyncio.sleep(max(0.0, self.cooldown - (time.monotonic() - self.opened_at)))
+            else:
+                await asyncio.sleep(0.5)  # waiting for the probe's verdict
+
+    def stats(self) -> Dict[str, Any]:
+        """Breaker state for the metrics tool."""
+        return {
+            "state": self.state,
+            "recent_failure_rate": round(sum(self.outcomes) / len(self.outcomes), 3) if self.outcomes else 0.0,
+            "opens": self.opens,
+            "rejected_calls": self.rejected,
+        }
+
+circuit_breaker = CircuitBreaker(
+    failure_rate=float(os.getenv("EDUCHAIN_BREAKER_FAILURE_RATE", "0.5")),
+    slow_seconds=float(os.getenv("EDUCHAIN_BREAKER_SLOW_SECONDS", "45")),
+    cooldown=float(os.getenv("EDUCHAIN_BREAKER_COOLDOWN_SECONDS", "30")),
 )
 
-def get_gemini_response(prompt: str) -> str:
+# Monotonic time by which the current tool call must finish; None means no deadline
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("deadline", default=None)
+DEFAULT_TOOL_TIMEOUT = float(os.getenv("EDUCHAIN_TIMEOUT_SECONDS", "120"))
+
+def tool_timeout(tool: str, requested: float | None = None) -> float:
+    """Seconds <tool> may run: <requested> if given, else EDUCHAIN_TIMEOUT_<TOOL>, else EDUCHAIN_TIMEOUT_SECONDS."""
+    if requested and requested > 0:
+        return requested
+    return float(os.getenv(f"EDUCHAIN_TIMEOUT_{tool.upper()}", DEFAULT_TOOL_TIMEOUT))
+
+@contextmanager
+def deadline(seconds: float):
+    """Bound everything awaited inside to <seconds> from now; an earlier enclosing deadline still applies."""
+    limit = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(limit if current is None else min(current, limit))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def within_deadline() -> asyncio.Timeout:
+    """asyncio.timeout for the time left before the current deadline; raises TimeoutError if it has passed."""
+    limit = _deadline.get()
+    if limit is None:
+        return asyncio.timeout(None)
+    remaining = limit - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("Deadline exceeded")
+    return asyncio.timeout(remaining)
+
+async def model_call(call: Callable[[GeminiTransport], Any], client: str = "genai") -> Any:
+    """
+    Run one upstream model call without blocking the event loop.
+
+    The named client is built off the event loop if needed. Calls on the
+    direct "genai" client must return an awaitable; the Educhain engine is
+    synchronous, so "educhain" calls are moved to a worker thread. Either way
+    the call runs on the least-loaded API key and is admitted by that key's
+    rate limiter; it is queued while quotas are exhausted and retried on
+    another key after a 429. While the circuit breaker is open the call fails
+    immediately with CircuitOpenError. Time spent queueing and generating
+    counts against the current deadline, and TimeoutError is raised when it
+    passes; cancelling the caller (e.g. an MCP cancellation) aborts the HTTP
+    request and frees the slot.
+
+    Args:
+        call: Function taking a GeminiTransport and issuing the request.
+        client (str): Which client the call uses, "genai" or "educhain".
+
+    Returns:
+        The model response.
+    """
+    scope = within_deadline()
+    probe = circuit_breaker.before_call()
+    started: float | None = None
+
+    def timed(transport: GeminiTransport) -> Any:
+        # Runs once the call has been admitted, so queueing for a key does not count as upstream latency
+        nonlocal started
+        started = time.monotonic()
+        return call(transport)
+
+    def upstream_seconds() -> float:
+        return time.monotonic() - started if started is not None else 0.0
+
+    try:
+        async with scope:
+            result = await key_pool.run(timed, client)
+    except TimeoutError:
+        # Our own deadline says nothing about Gemini's health, unless the call was slow anyway
+        if upstream_seconds() > circuit_breaker.slow_seconds:
+            circuit_breaker.record(True, probe)
+        else:
+            circuit_breaker.abandon(probe)
+        raise TimeoutError("Deadline exceeded") from None
+    except Exception:
+        circuit_breaker.record(True, probe)
+        raise
+    except BaseException:
+        circuit_breaker.abandon(probe)
+        raise
+    circuit_breaker.record(upstream_seconds() > circuit_breaker.slow_seconds, probe)
+    return result
+
+@functools.lru_cache(maxsize=64)
+def json_mode(response_schema: Any) -> dict:
+    """
+    Gemini config for JSON output following <response_schema>, converted to a JSON
+    schema once: left to the SDK, the conversion runs on the event loop for every call.
+    """
+    return {"response_mime_type": "application/json", "response_json_schema": TypeAdapter(response_schema).json_schema()}
+
+
+async def get_gemini_response(prompt: str, response_schema: Any = None) -> str:
     """
     Get a response from the Gemini API for a given prompt.
     
     Args:
         prompt (str): The input prompt to send to the Gemini API.
+        response_schema (optional): Pydantic model or type the output must follow;
+            enables Gemini's JSON mode.
     
     Returns:
         str: The response text from the Gemini API.
     """
-    client = genai.Client()
-    response = client.models.generate_content(
-        model="gemini-2.5-flash", contents=prompt
+    config = json_mode(response_schema) if response_schema else None
+    response = await model_call(
+        lambda t: t.genai.aio.models.generate_content(model=GEMINI_MODEL, contents=prompt, config=config)
     )
     return response.text
 
 
-def clean_and_parse_json(json_string):
+async def stream_gemini_response(
+    prompt: str, on_chunk: Callable[[str], Awaitable[None]], response_schema: Any = None
+) -> str:
+    """
+    Stream a Gemini response, handing each text chunk to <on_chunk> as it arrives.
+
+    The generation slot is held until the stream is exhausted.
+
+    Returns:
+        str: The full response text.
+    """
+    config = json_mode(response_schema) if response_schema else None
+
+    async def consume(t: GeminiTransport) -> str:
+        parts = []
+        stream = await t.genai.aio.models.generate_content_stream(model=GEMINI_MODEL, contents=prompt, config=config)
+        async for chunk in stream:
+            if chunk.text:
+                parts.append(chunk.text)
+                await on_chunk(chunk.text)
+        return "".join(parts)
+
+    return await model_call(consume)
+
+
+# One token per match, leading whitespace skipped: whole strings (double, single
+# or smart-quoted, possibly unterminated), structural characters, numbers, bare
+# words, or any other single character. A double quote inside a string only
+# counts as the closing quote when what follows can continue the document: a
+# colon or closing bracket, a comma and then the start of another value (a
+# string only if a delimiter follows it too), or a line break and then another
+# string (a member missing its comma). Any other double quote is an unescaped
+# quote inside the string.
+_JSON_TOKEN = re.compile(
+    r"""
+    \s*(?:
+    "(?P<dq>(?:[^"\\]|\\.|"(?!
+        \s*(?:[:}\]]|$|,\s*(?:"(?:[^"\\]|\\.)*"\s*[:,}\]]|['“{\[\]}\-\d]|(?:true|false|null|True|False|None)\b|$))
+      | [\ \t]*\r?\n\s*"
+    ))*)(?:"|\Z)
+  | '(?P<sq>(?:[^'\\]|\\.)*)(?:'|\Z)
+  | “(?P<smart>[^”]*)(?:”|\Z)
+  | (?P<open>[{\[])
+  | (?P<close>[}\]])
+  | (?P<comma>,)
+  | (?P<number>-?\d[\d.eE+-]*)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<other>.)
+    )
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+_JSON_OPEN = re.compile(r"[{\[]")
+_JSON_DECODER = json.JSONDecoder(strict=False)
+_UNESCAPED_QUOTE = re.compile(r'(?<!\\)((?:\\\\)*)"')
+_JSON_LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+
+
+def _quote_json_string(body: str) -> str:
+    """Wrap a raw string body in double quotes, escaping bare double quotes and dropping \\' escapes."""
+    if "\\'" in body:
+        body = body.replace("\\'", "'")
+    if '"' in body:
+        body = _UNESCAPED_QUOTE.sub(r'\1\\"', body)
+    return f'"{body}"'
+
+
+def _json_fence(text: str) -> range:
+    """Span of the first ```json or bare ``` fenced block that contains a bracket; unterminated blocks run to the end."""
+    fence = text.find("```")
+    while fence != -1:
+        body = text.find("\n", fence) + 1
+        if not body:
+            break
+        end = text.find("```", body)
+        end = len(text) if end == -1 else end
+        if text[fence + 3:body].strip().lower() in ("", "json") and _JSON_OPEN.search(text, body, end):
+            return range(body, end)
+        fence = text.find("```", end + 3)
+    return range(0)
+
+
+def json_starts(text: str, expect: type | None = None) -> Iterator[int]:
+    """
+    Offsets where the JSON value in LLM output may start, most likely first.
+
+    Brackets inside the first ```json (or bare ```) fenced block come first,
+    then every other '{' or '[' in order, so a bracket in the prose before the
+    JSON is only a later candidate. With <expect> set to dict or list, only
+    '{' or '[' respectively are candidates.
+    """
+    opener = _JSON_OPEN if expect is None else re.compile(re.escape({dict: "{", list: "["}[expect]))
+    fenced = _json_fence(text)
+    for match in opener.finditer(text, fenced.start, fenced.stop):
+        yield match.start()
+    for match in opener.finditer(text):
+        if match.start() not in fenced:
+            yield match.start()
+
+
+def repair_json(text: str, start: int | None = None) -> str:
+    """
+    Extract a balanced JSON value from LLM output and repair common defects.
+
+    The text is tokenized in a single pass starting at <start>, by default the
+    most likely start found by json_starts (a fenced block before the prose).
+    Markdown fences and surrounding prose are dropped, single- and smart-quoted
+    strings become JSON strings, Python literals (True/False/None) become JSON
+    literals, unescaped quotes inside strings are escaped, trailing commas are
+    removed, missing commas between values are inserted and a truncated value
+    is closed. String contents are left intact.
+
+    Args:
+        text (str): Raw model output.
+        start (int, optional): Offset of the opening '{' or '['.
+
+    Returns:
+        str: A JSON document suitable for json.loads(..., strict=False).
+
+    Raises:
+        ValueError: If the text contains no JSON object or array.
+    """
+    if start is None:
+        start = next(json_starts(text), None)
+        if start is None:
+            raise ValueError("No JSON object or array found in model output")
+
+    out: list[str] = []
+    stack: list[str] = []
+    pending_comma = False
+    value_ended = False  # the last token completed a value, so another one needs a comma first
+    for match in _JSON_TOKEN.finditer(text, start):
+        kind = match.lastgroup
+        token = match.group(kind)
+        if kind == "close":
+            pending_comma = False
+            value_ended = True
+            if stack:
+                out.append(stack.pop())
+            if not stack:
+                break
+            continue
+        if pending_comma or (value_ended and kind in ("open", "dq", "sq", "smart", "number", "word")):
+            out.append(",")
+            pending_comma = False
+        value_ended = kind in ("dq", "sq", "smart", "number", "word")
+        if kind == "comma":
+            pending_comma = True
+        elif kind == "open":
+            out.append(token)
+            stack.append("}" if token == "{" else "]")
+        elif kind in ("dq", "sq", "smart"):
+            out.append(_quote_json_string(match.group(kind)))
+        elif kind == "word":
+            out.append(_JSON_LITERALS.get(token) or f'"{token}"')
+        else:
+            out.append(token)
+
+    if out and out[-1] == ":":
+        out.append("null")
+    out.extend(reversed(stack))
+    return "".join(out)
+
+
+def clean_and_parse_json(json_string, expect: type | None = None):
     """
-    Cleans a string by removing common unnecessary characters and escape sequences,
-    then attempts to parse it as JSON.
+    Extracts and repairs the JSON value in an LLM response, then parses it.
+
+    Each candidate start from json_starts is tried in turn, and the first one
+    whose value parses, as is or once repaired, is returned.
 
     Args:
         json_string: The string potentially containing JSON with extra characters.
+        expect (type, optional): dict or list, when the caller needs that type.
+
+    Returns:
+        A Python dictionary/list if parsing is successful.
+        Raises a ValueError if the repaired string is still not valid JSON.
+    """
+    error: Exception | None = None
+    for start in json_starts(json_string, expect):
+        # Fast path: well-formed JSON parses directly from its opening bracket
+        try:
+            return _JSON_DECODER.raw_decode(json_string, start)[0]
+        except json.JSONDecodeError:
+            pass
+        repaired = repair_json(json_string, start)
+        try:
+            return json.loads(repaired, strict=False)
+        except json.JSONDecodeError as e:
+            error = error or ValueError(f"Could not decode JSON after repair: {e}. Repaired string: '{repaired[:500]}'")
+    raise error or ValueError("No JSON object or array found in model output")
+
+class StreamingJSONParser:
+    """
+    Incremental JSON scanner for streamed model output.
+
+    Text is fed in chunks as it arrives. Whenever a value nested exactly
+    <emit_depth> levels deep is complete (a member of the top-level object for
+    depth 1, an element of a top-level member's array for depth 2, ...), it is
+    parsed and returned together with its path, long before the whole document
+    has arrived. Anything before the first '{' or '[' (such as a Markdown
+    fence) is ignored.
+
+    Args:
+        emit_depth (int): Nesting depth of the values to report.
+    """
+
+    def __init__(self, emit_depth: int = 1):
+        self.emit_depth = emit_depth
+        self._buffer = ""
+        self._pos = 0
+        self._stack: list[dict] = []  # open containers: bracket, current key/index, value start
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._done = False
+
+    def feed(self, chunk: str) -> list[tuple[tuple, Any]]:
+        """
+        Consume the next chunk of text.
+
+        Returns:
+            list: (path, value) pairs for every value completed by this chunk.
+        """
+        self._buffer += chunk
+        completed: list[tuple[tuple, Any]] = []
+        buffer, stack = self._buffer, self._stack
+        i = self._pos
+        while i < len(buffer) and not self._done:
+            char = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    top = stack[-1]
+                    if top["bracket"] == "{" and top["expect_key"]:
+                        top["key"] = json.loads(buffer[self._string_start:i + 1], strict=False)
+                        top["expect_key"] = False
+                    else:
+                        self._complete(top, i + 1, completed)
+            elif char in "{[":
+                if stack:
+                    self._begin_value(stack[-1], i)
+                stack.append({"bracket": char, "key": None if char == "{" else 0, "start": None, "expect_key": char == "{"})
+            elif not stack:
+                pass  # prose or fences before the document
+            elif char in "}]":
+                top = stack[-1]
+                if top["start"] is not None:
+                    self._complete(top, i, completed)
+                stack.pop()
+                if stack:
+                    self._complete(stack[-1], i + 1, completed)
+                else:
+                    self._done = True
+            elif char == '"':
+                self._in_string = True
+                self._string_start = i
+                top = stack[-1]
+                if not (top["bracket"] == "{" and top["expect_key"]):
+                    self._begin_value(top, i)
+            elif char == ",":
+                top = stack[-1]
+                if top["start"] is not None:
+                    self._complete(top, i, completed)
+                if top["bracket"] == "{":
+                    top["expect_key"] = True
+            elif char not in " \t\r\n:":
+                self._begin_value(stack[-1], i)
+            i += 1
+        self._pos = i
+        return completed
+
+    def _begin_value(self, container: dict, index: int) -> None:
+        if container["start"] is None:
+            container["start"] = index
+
+    def _complete(self, container: dict, end: int, completed: list) -> None:
+        """Close the value that started at container["start"] and report it if it sits at emit_depth."""
+        start = container["start"]
+        if start is None:
+            return
+        container["start"] = None
+        if len(self._stack) == self.emit_depth:
+            path = tuple(entry["key"] for entry in self._stack)
+            try:
+                completed.append((path, json.loads(self._buffer[start:end], strict=False)))
+            except json.JSONDecodeError:
+                pass
+        if container["bracket"] == "[":
+            container["key"] += 1
+
+def normalize_arg(value: Any) -> Any:
+    """Fold case and whitespace so equivalent tool arguments share a cache key."""
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    return value
+
+
+class ResultCache:
+    """
+    In-process LRU cache for tool results, bounded by entry count and bytes,
+    with per-entry TTL and single-flight coalescing of identical requests.
+    Expired entries stay until evicted or replaced, so last_value() can still
+    serve them as stale results.
+
+    Args:
+        max_entries (int): Maximum number of cached results.
+        max_bytes (int): Maximum total JSON size of cached results.
+        ttl (float): Seconds a result stays fresh.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 8 * 1024 * 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at, size, value)
+        self._inflight: dict = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key) -> Any:
+        """Return a copy of the fresh value for key, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return copy.deepcopy(entry[2])
+
+    def last_value(self, key) -> Any:
+        """Return a copy of the value stored for key even if it has expired, or None."""
+        entry = self._entries.get(key)
+        return copy.deepcopy(entry[2]) if entry is not None else None
+
+    def put(self, key, value: Any) -> None:
+        """Store value under key, evicting least recently used entries as needed."""
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, copy.deepcopy(value))
+        self.bytes += size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, key) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    async def get_or_compute(
+        self,
+        key,
+        compute: Callable[[], Awaitable[Any]],
+        bypass: bool = False,
+        cache_if: Callable[[Any], bool] | None = None,
+    ) -> Any:
+        """
+        Return the cached value for key, or run compute() once and cache its result.
+
+        Concurrent callers with the same key wait on the first caller's
+        computation instead of starting their own upstream call.
+
+        Args:
+            key: Hashable, already-normalized cache key.
+            compute: Coroutine factory producing the value on a miss.
+            bypass (bool): Skip the lookup and coalescing; the fresh result is still stored.
+            cache_if: Optional predicate; results failing it are returned but not stored.
+
+        Returns:
+            The cached or freshly computed value.
+        """
+        while not bypass:
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            self.coalesced += 1
+            try:
+                return copy.deepcopy(await asyncio.shield(pending))
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The leading caller was cancelled; retry and take over.
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if not bypass:
+            self._inflight[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        if cache_if is None or cache_if(value):
+            self.put(key, value)
+        future.set_result(value)
+        return copy.deepcopy(value)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and occupancy for the metrics tool."""
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+result_cache = ResultCache(
+    max_entries=int(os.getenv("EDUCHAIN_CACHE_MAX_ENTRIES", "256")),
+    max_bytes=int(os.getenv("EDUCHAIN_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+    ttl=float(os.getenv("EDUCHAIN_CACHE_TTL", "3600")),
+)
+
+_refreshes: Dict[Any, asyncio.Task] = {}
+
+def mark_stale(value: Any) -> Any:
+    """Flag a result (or each question of a list result) with "stale": True."""
+    if isinstance(value, list):
+        return [{**item, "stale": True} if isinstance(item, dict) else item for item in value]
+    if isinstance(value, dict):
+        return {**value, "stale": True}
+    return value
+
+def refresh_when_recovered(key, compute: Callable[[], Awaitable[Any]], cache_if: Callable[[Any], bool] | None) -> None:
+    """Recompute <key> in the background once the circuit breaker lets calls through, and cache the result."""
+    if key in _refreshes:
+        return
+
+    async def refresh() -> None:
+        try:
+            for _ in range(5):
+                await circuit_breaker.recovered()
+                try:
+                    value = await compute()
+                except CircuitOpenError:
+                    continue
+                except Exception:
+                    return
+                if cache_if is None or cache_if(value):
+                    result_cache.put(key, value)
+                    return
+                if circuit_breaker.state == "closed":
+                    return
+        finally:
+            _refreshes.pop(key, None)
+
+    # Started without the caller's context, so the request's deadline does not apply
+    _refreshes[key] = asyncio.get_running_loop().create_task(refresh(), context=contextvars.Context())
+
+async def cached_or_stale(
+    key,
+    compute: Callable[[], Awaitable[Any]],
+    bypass: bool = False,
+    cache_if: Callable[[Any], bool] | None = None,
+    fallback: Callable[[], Any] | None = None,
+    refresh: Callable[[], Awaitable[Any]] | None = None,
+) -> Any:
+    """
+    result_cache.get_or_compute, serving stale results while Gemini is down.
+
+    If the computation is cut short by the open circuit breaker (it raises
+    CircuitOpenError, or returns a result rejected by <cache_if>), the last
+    value cached for <key> is returned instead, even if expired, or else
+    <fallback>() such as banked questions. Stale results are marked with
+    "stale": True and the key is refreshed in the background, with <refresh>
+    (default <compute>), once Gemini recovers. Without any stale value the
+    original outcome is returned.
+    """
+    try:
+        value = await result_cache.get_or_compute(key, compute, bypass=bypass, cache_if=cache_if)
+    except CircuitOpenError:
+        stale = result_cache.last_value(key) or (fallback() if fallback else None)
+        if not stale:
+            raise
+    else:
+        if circuit_breaker.state == "closed" or cache_if is None or cache_if(value):
+            return value
+        stale = result_cache.last_value(key) or (fallback() if fallback else None)
+        if not stale:
+            return value
+    refresh_when_recovered(key, refresh or compute, cache_if)
+    return mark_stale(stale)
+
+# MinHash/LSH parameters for near-duplicate question detection: 64 hash
+# values split into 16 bands of 4, so questions with a Jaccard similarity of
+# 0.7 or more share at least one bucket about 99% of the time.
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+_WORD = re.compile(r"[a-z0-9]+")
+_STOP_WORDS = frozenset(
+    "a an the of to in on for is are was were be been what which who whom whose when where why how "
+    "does do did this that these those it its and or with by from as at following".split()
+)
+
+
+def question_terms(text: str) -> set[str]:
+    """Content words of a question, lower-cased with a plural 's' stripped."""
+    terms = {
+        word[:-1] if len(word) > 3 and word.endswith("s") else word
+        for word in _WORD.findall(text.lower())
+        if word not in _STOP_WORDS
+    }
+    return terms or {text.lower()}
+
+
+def minhash_signature(text: str) -> bytes:
+    """
+    Compute the MinHash signature of a question's content words.
+
+    Each term is hashed once into MINHASH_PERMUTATIONS independent 32-bit
+    values (SHAKE-128 output), and the signature keeps the column-wise minimum.
+    Reordered or lightly reworded questions get similar signatures, and the
+    packed bytes are stable across restarts so they can be stored in the bank.
+    """
+    columns = zip(*(array("I", hashlib.shake_128(term.encode()).digest(4 * MINHASH_PERMUTATIONS)) for term in question_terms(text)))
+    return array("I", map(min, columns)).tobytes()
+
+
+class QuestionBank:
+    """
+    Persistent SQLite store of generated MCQs, keyed by normalized topic and level.
+
+    Every generated question is kept on disk and flagged once it has been
+    served, so later requests can be answered from unseen stock and only the
+    shortfall needs a model call. The bank survives server restarts.
+
+    Args:
+        path (str): SQLite database file (created if missing).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY,
+                topic TEXT NOT NULL,
+                level TEXT NOT NULL,
+                question TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                served INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_questions_stock ON questions (topic, level, served, id);
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_questions_text ON questions (topic, level, question);
+            """
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(questions)")}
+        if "signature" not in columns:
+            self._db.execute("ALTER TABLE questions ADD COLUMN signature BLOB")
+        self.served_from_stock = 0
+        self.stored = 0
+
+    def take_unseen(self, topic: str, level: str, limit: int) -> list[dict]:
+        """Return up to <limit> unseen questions and mark them as served."""
+        rows = self._db.execute(
+            "SELECT id, payload FROM questions WHERE topic = ? AND level = ? AND served = 0 ORDER BY id LIMIT ?",
+            (normalize_arg(topic), normalize_arg(level), limit),
+        ).fetchall()
+        if rows:
+            ids = [row[0] for row in rows]
+            self._db.execute(f"UPDATE questions SET served = 1 WHERE id IN ({','.join('?' * len(ids))})", ids)
+        self.served_from_stock += len(rows)
+        return [json.loads(row[1]) for row in rows]
+
+    def restock(self, topic: str, level: str, questions: list[dict]) -> None:
+        """Mark questions returned by take_unseen as unseen again, e.g. when the request they were for failed."""
+        texts = [q["question"] for q in questions if isinstance(q, dict) and q.get("question")]
+        if not texts:
+            return
+        self._db.execute(
+            f"UPDATE questions SET served = 0 WHERE topic = ? AND level = ? AND question IN ({','.join('?' * len(texts))})",
+            (normalize_arg(topic), normalize_arg(level), *texts),
+        )
+        self.served_from_stock -= len(texts)
+
+    def existing(self, topic: str, level: str, limit: int) -> list[dict]:
+        """Return up to <limit> stored questions, already-served ones first, without consuming stock."""
+        rows = self._db.execute(
+            "SELECT payload FROM questions WHERE topic = ? AND level = ? ORDER BY served DESC, id DESC LIMIT ?",
+            (normalize_arg(topic), normalize_arg(level), limit),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def add(self, topic: str, level: str, questions: list[dict], served: bool = True) -> None:
+        """Store newly generated questions; exact duplicates are ignored."""
+        now = time.time()
+        with self._db:
+            self._db.execute("BEGIN")
+            cursor = self._db.executemany(
+                "INSERT OR IGNORE INTO questions (topic, level, question, payload, served, created_at, signature)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        normalize_arg(topic), normalize_arg(level), q["question"], json.dumps(q), int(served), now,
+                        minhash_signature(q["question"]),
+                    )
+                    for q in questions
+                    if isinstance(q, dict) and q.get("question")
+                ],
+            )
+        self.stored += max(cursor.rowcount, 0)
+
+    def signatures(self, topic: str, level: str) -> list[bytes]:
+        """
+        Return the MinHash signatures of every stored question, backfilling rows that lack one.
+        Uses its own connection, so it can run on a worker thread.
+        """
+        signatures, backfill = [], []
+        db = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            for row_id, question, signature in db.execute(
+                "SELECT id, question, signature FROM questions WHERE topic = ? AND level = ?",
+                (normalize_arg(topic), normalize_arg(level)),
+            ):
+                if signature is None:
+                    signature = minhash_signature(question)
+                    backfill.append((signature, row_id))
+                signatures.append(signature)
+            if backfill:
+                with db:
+                    db.execute("BEGIN")
+                    db.executemany("UPDATE questions SET signature = ? WHERE id = ?", backfill)
+        finally:
+            db.close()
+        return signatures
+
+    def stats(self) -> Dict[str, Any]:
+        """Stock levels and traffic counters for the metrics tool."""
+        total, unseen = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(served = 0), 0) FROM questions"
+        ).fetchone()
+        return {
+            "questions": total,
+            "unseen": unseen,
+            "served_from_stock": self.served_from_stock,
+            "stored": self.stored,
+        }
+
+question_bank = QuestionBank(
+    os.getenv("EDUCHAIN_BANK_PATH")
+    or os.path.join(os.path.dirname(os.path.abspath(__file__)), "question_bank.sqlite3")
+)
+
+# Bucket keys fold each band of a signature into 64 bits by XOR-ing its 64-bit words
+_BAND_WORDS = 4 * MINHASH_PERMUTATIONS // LSH_BANDS // 8
+
+
+def band_keys(signature: bytes) -> list[int]:
+    """One 64-bit LSH bucket key per band of a MinHash signature."""
+    words = memoryview(signature).cast("Q")
+    return [functools.reduce(operator.xor, words[band * _BAND_WORDS:(band + 1) * _BAND_WORDS]) for band in range(LSH_BANDS)]
+
+
+class TopicIndex:
+    """
+    Compact LSH buckets for the questions of one topic and level.
+
+    Signatures are packed into one array('I'), MINHASH_PERMUTATIONS values per
+    row. Each band has a sorted array('Q') of bucket keys and a parallel
+    array('I') of row numbers, so a question costs about 450 bytes however
+    many buckets it lands in, and lookups are binary searches.
+    """
+
+    def __init__(self, signatures: list[bytes]):
+        self.signatures = array("I", b"".join(signatures))
+        self.keys: list[array] = []
+        self.rows: list[array] = []
+        words = memoryview(self.signatures).cast("B").cast("Q")
+        stride = MINHASH_PERMUTATIONS // 2  # 64-bit words per signature
+        for band in range(LSH_BANDS):
+            first = band * _BAND_WORDS
+            keys = functools.reduce(
+                lambda keys, word: list(map(operator.xor, keys, words[first + word::stride])),
+                range(1, _BAND_WORDS),
+                list(words[first::stride]),
+            )
+            rows = sorted(range(len(keys)), key=keys.__getitem__)
+            self.keys.append(array("Q", map(keys.__getitem__, rows)))
+            self.rows.append(array("I", rows))
+
+    def __len__(self) -> int:
+        return len(self.signatures) // MINHASH_PERMUTATIONS
+
+    def candidates(self, keys: list[int]) -> set[int]:
+        """Rows sharing at least one bucket with a signature whose band keys are <keys>."""
+        found = set()
+        for band, key in enumerate(keys):
+            sorted_keys, rows = self.keys[band], self.rows[band]
+            i = bisect.bisect_left(sorted_keys, key)
+            while i < len(sorted_keys) and sorted_keys[i] == key:
+                found.add(rows[i])
+                i += 1
+        return found
+
+    def signature(self, row: int) -> array:
+        return self.signatures[row * MINHASH_PERMUTATIONS:(row + 1) * MINHASH_PERMUTATIONS]
+
+    def add(self, signature: bytes, keys: list[int]) -> None:
+        row = len(self)
+        self.signatures.frombytes(signature)
+        for band, key in enumerate(keys):
+            i = bisect.bisect_right(self.keys[band], key)
+            self.keys[band].insert(i, key)
+            self.rows[band].insert(i, row)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index of question text per topic and level.
+
+    Each signature is split into LSH_BANDS bands and bucketed by band value, so
+    a lookup only compares against questions sharing a bucket instead of the
+    whole bank. A topic's index is loaded from the question bank on first use,
+    on a worker thread via prepare(), and then kept in memory as a TopicIndex.
+
+    Args:
+        bank (QuestionBank): Source of previously stored questions.
+        threshold (float): Estimated Jaccard similarity at or above which two
+            questions count as duplicates.
+    """
+
+    def __init__(self, bank: QuestionBank, threshold: float = 0.7):
+        self.bank = bank
+        self.threshold = threshold
+        self._topics: Dict[Any, TopicIndex] = {}
+        self._loading: Dict[Any, asyncio.Task] = {}
+        self.indexed = 0
+        self.duplicates = 0
+
+    def _load(self, topic: str, level: str) -> TopicIndex:
+        index = TopicIndex(self.bank.signatures(topic, level))
+        self.indexed += len(index)
+        return index
+
+    def _index(self, topic: str, level: str) -> TopicIndex:
+        key = (normalize_arg(topic), normalize_arg(level))
+        index = self._topics.get(key)
+        if index is None:
+            index = self._topics[key] = self._load(topic, level)
+        return index
+
+    async def prepare(self, topic: str, level: str) -> None:
+        """
+        Load a topic's index on a worker thread, so a large bank does not stall
+        the event loop; concurrent callers for the same topic share one load.
+        """
+        key = (normalize_arg(topic), normalize_arg(level))
+        if key in self._topics:
+            return
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = self._loading[key] = asyncio.get_running_loop().create_task(
+                asyncio.to_thread(self._load, topic, level)
+            )
+
+            def loaded(task: asyncio.Task) -> None:
+                del self._loading[key]
+                if not task.cancelled() and task.exception() is None:
+                    self._topics.setdefault(key, task.result())
+
+            loading.add_done_callback(loaded)
+        await asyncio.shield(loading)
+
+    def admit(self, topic: str, level: str, question: str) -> bool:
+        """
+        Index <question> unless it near-duplicates one already known for the topic.
+
+        Returns:
+            bool: True if the question is new and was indexed, False if it is a duplicate.
+        """
+        index = self._index(topic, level)
+        signature = minhash_signature(question)
+        keys = band_keys(signature)
+        values = array("I", signature)
+        needed = self.threshold * MINHASH_PERMUTATIONS
+        for row in index.candidates(keys):
+            if sum(x == y for x, y in zip(values, index.signature(row))) >= needed:
+                self.duplicates += 1
+                return False
+        index.add(signature, keys)
+        self.indexed += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Index size and duplicate counter for the metrics tool."""
+        return {"topics_loaded": len(self._topics), "indexed": self.indexed, "duplicates_filtered": self.duplicates}
+
+duplicate_index = NearDuplicateIndex(question_bank)
+
+class ChunkTuner:
+    """
+    Adaptive chunk size for splitting large MCQ requests into parallel calls.
+
+    Keeps exponentially weighted averages of per-question latency and chunk
+    failure rate, and sizes chunks so that one chunk should finish within
+    <target_latency> seconds, shrinking further while chunks keep failing.
+
+    Args:
+        initial (int): Chunk size used before anything has been observed.
+        minimum (int): Smallest chunk size.
+        maximum (int): Largest chunk size.
+        target_latency (float): Desired seconds per chunk call.
+    """
+
+    def __init__(self, initial: int = 10, minimum: int = 3, maximum: int = 25, target_latency: float = 20.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.size = initial
+        self.seconds_per_question: float | None = None
+        self.failure_rate = 0.0
+
+    def record(self, requested: int, received: int, seconds: float) -> None:
+        """Feed back one chunk outcome; a short or failed chunk counts as a failure."""
+        alpha = 0.3
+        failed = received < requested
+        self.failure_rate = (1 - alpha) * self.failure_rate + alpha * float(failed)
+        if received:
+            per_question = seconds / received
+            if self.seconds_per_question is None:
+                self.seconds_per_question = per_question
+            else:
+                self.seconds_per_question = (1 - alpha) * self.seconds_per_question + alpha * per_question
+        if self.seconds_per_question:
+            size = self.target_latency / self.seconds_per_question * (1 - self.failure_rate)
+        else:
+            size = self.size / 2
+        self.size = int(min(self.maximum, max(self.minimum, size)))
+
+    def plan(self, num: int) -> list[int]:
+        """Split <num> questions into near-equal chunks no larger than the current size."""
+        chunks = -(-num // self.size)
+        return [num // chunks + (1 if i < num % chunks else 0) for i in range(chunks)]
+
+    def stats(self) -> Dict[str, Any]:
+        """Current tuning state for the metrics tool."""
+        return {
+            "chunk_size": self.size,
+            "seconds_per_question": self.seconds_per_question,
+            "failure_rate": round(self.failure_rate, 3),
+        }
+
+chunk_tuner = ChunkTuner(
+    initial=int(os.getenv("EDUCHAIN_CHUNK_SIZE", "10")),
+    target_latency=float(os.getenv("EDUCHAIN_CHUNK_TARGET_SECONDS", "20")),
+)
+MAX_CHUNK_ROUNDS = 3
+
+@asynccontextmanager
+async def warm_up_in_background(server: FastMCP):
+    """
+    Build the Gemini clients on a worker thread once the server starts.
+
+    Nothing awaits the warm-up, so initialize and tools/list are answered
+    immediately; a tool call that arrives first simply waits for its client.
+    The generation job workers run for as long as the server does, resuming
+    jobs left unfinished by a previous run.
+    """
+    asyncio.get_running_loop().run_in_executor(None, key_pool.warm_up)
+    job_queue.start()
+    try:
+        yield
+    finally:
+        await job_queue.stop()
+
+mcp = FastMCP("Educhain MCP Server", lifespan=warm_up_in_background)
+
+class MultipleChoiceQuestion(BaseModel):
+    """Same fields, in the same order, as Educhain's MultipleChoiceQuestion."""
+    question: str
+    answer: str
+    explanation: str | None = None
+    options: list[str]
+
+class MCQList(BaseModel):
+    """Response schema for the direct backend, shaped like Educhain's MCQList."""
+    questions: list[MultipleChoiceQuestion]
+
+def mcq_prompt(topic: str, level: str, num: int) -> str:
+    """Prompt for the direct backend, mirroring Educhain's multiple-choice template."""
+    return (
+        f"Generate {num} Multiple Choice question(s) based on the given topic.\n"
+        f"Topic: {topic}\n"
+        f"Difficulty level: {level}\n\n"
+        "For each question, provide:\n"
+        "1. The question\n"
+        "2. The correct answer\n"
+        "3. An explanation\n"
+        "4. A list of options (including the correct answer)"
+    )
+
+async def stream_mcqs(
+    topic: str, level: str, num: int, on_question: Callable[[dict], Awaitable[None]]
+) -> list[dict]:
+    """
+    Stream <num> MCQs from Gemini, passing each question to <on_question> as
+    soon as it has been parsed off the stream.
+
+    Educhain's engine cannot stream, so this always talks to Gemini directly
+    with the MCQList response schema.
+    """
+    parser = StreamingJSONParser(emit_depth=2)
+    questions: list[dict] = []
+
+    async def forward(chunk: str) -> None:
+        for path, value in parser.feed(chunk):
+            if path[0] != "questions":
+                continue
+            try:
+                question = MultipleChoiceQuestion.model_validate(value).model_dump()
+            except ValueError:
+                continue
+            questions.append(question)
+            await on_question(question)
+
+    await stream_gemini_response(mcq_prompt(topic, level, num), forward, response_schema=MCQList)
+    return questions
+
+async def request_mcqs(
+    topic: str, level: str, num: int, on_question: Callable[[dict], Awaitable[None]] | None = None
+) -> list[dict]:
+    """
+    Ask the configured backend for <num> MCQs in qna_engine.generate_questions(...).model_dump() shape.
+    With <on_question>, the questions are streamed (see stream_mcqs).
+    """
+    if on_question is not None:
+        return await stream_mcqs(topic, level, num, on_question)
+    if MODEL_BACKEND == "direct":
+        response = await model_call(
+            lambda t: t.genai.aio.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=mcq_prompt(topic, level, num),
+                config={"response_mime_type": "application/json", "response_schema": MCQList},
+            )
+        )
+        return response.parsed.model_dump()["questions"] if response.parsed else []
+    result = await model_call(
+        lambda t: t.educhain.qna_engine.generate_questions(
+            topic=topic, num=num, question_type="Multiple Choice", difficulty_level=level
+        ),
+        client="educhain",
+    )
+    return result.model_dump()["questions"]
+
+class MCQSet(BaseModel):
+    set: int
+    questions: list[MultipleChoiceQuestion]
+
+class MCQSetList(BaseModel):
+    """Response schema for a micro-batch: one numbered set of questions per request."""
+    sets: list[MCQSet]
+
+async def request_mcq_sets(specs: list[tuple[str, str, int]]) -> Dict[int, list[dict]]:
+    """
+    Generate MCQs for several (topic, level, num) specs with one Gemini call.
 
     Returns:
-        A Python dictionary/list if parsing is successful, None otherwise.
-        Raises a ValueError if the cleaned string is still not valid JSON.
-    """
-    # Remove common problematic characters and escape sequences
-    # This is a heuristic and might need adjustment based on specific input patterns.
-    cleaned_string = json_string.replace("'''", " ") \
-                                .replace('"""', " ") \
-                                .replace('```', " ") \
-                                .replace('`', " ") \
-                                .replace('**', " ") \
-                                .replace('*', " ") \
-                                .replace('\\n', ' ') \
-                                .replace('\\t', ' ') \
-                                .replace('\\"', '"') \
-                                .replace("\\'", "'")\
-                                .replace('\n', ' ') \
-                                .replace('\t', ' ') \
-                                .replace('\"', '"') \
-                                .replace("\'", "'")\
-                                .replace('\\', ' ').strip()  # Remove leading/trailing whitespace
-
-    # Attempt to parse the cleaned string as JSON
+        dict: Questions per spec index. Empty unless the response numbers its
+            sets exactly 0..n-1, once each, since questions can only be handed
+            to the right caller through those numbers.
+    """
+    listing = "\n".join(
+        f"Set {i}: {num} question(s). Topic: {topic}. Difficulty level: {level}"
+        for i, (topic, level, num) in enumerate(specs)
+    )
+    prompt = (
+        "Generate Multiple Choice questions for each of the numbered sets below. "
+        "Return every set separately, with its set number and exactly the requested "
+        "number of questions on that set's topic.\n"
+        f"{listing}\n\n"
+        "For each question, provide:\n"
+        "1. The question\n"
+        "2. The correct answer\n"
+        "3. An explanation\n"
+        "4. A list of options (including the correct answer)"
+    )
+    response = await model_call(
+        lambda t: t.genai.aio.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=prompt,
+            config={"response_mime_type": "application/json", "response_schema": MCQSetList},
+        )
+    )
+    if not response.parsed:
+        return {}
+    sets = response.parsed.sets
+    if sorted(entry.set for entry in sets) != list(range(len(specs))):
+        # Numbered from 1, repeated or missing: no set can be trusted to belong to its caller
+        return {}
+    return {entry.set: [q.model_dump() for q in entry.questions] for entry in sets}
+
+class MCQBatcher:
+    """
+    Coalesces small concurrent MCQ requests into one multi-topic model call.
+
+    Requests for at most <max_questions> questions are held for up to <window>
+    seconds (or until <max_requests> are pending) and then generated together
+    with request_mcq_sets. Each caller gets its own set back; a caller whose set
+    is short, or every caller when the sets cannot be split cleanly, falls back
+    to an individual request_mcqs call, unless it has already given up waiting.
+
+    Args:
+        window (float): Seconds to wait for companions; 0 disables batching.
+        max_requests (int): Requests per batch.
+        max_questions (int): Largest request that is batched.
+    """
+
+    def __init__(self, window: float = 0.0, max_requests: int = 8, max_questions: int = 5):
+        self.window = window
+        self.max_requests = max_requests
+        self.max_questions = max_questions
+        self._pending: list[tuple[str, str, int, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.upstream_calls = 0
+        self.batched_requests = 0
+        self.fallbacks = 0
+
+    def accepts(self, num: int) -> bool:
+        """Whether a request for <num> questions should go through the batcher."""
+        return self.window > 0 and num <= self.max_questions
+
+    async def submit(self, topic: str, level: str, num: int) -> list[dict]:
+        """Queue one request and wait for its questions, up to the current deadline."""
+        scope = within_deadline()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((topic, level, num, future))
+        if len(self._pending) >= self.max_requests:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        async with scope:
+            return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # Shared by several callers, so none of their deadlines applies to it
+            task = asyncio.get_running_loop().create_task(self._run(batch), context=contextvars.Context())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[str, str, int, asyncio.Future]]) -> None:
+        sets: Dict[int, list[dict]] = {}
+        if len(batch) > 1:
+            self.upstream_calls += 1
+            try:
+                sets = await request_mcq_sets([(topic, level, num) for topic, level, num, _ in batch])
+            except Exception:
+                pass
+
+        async def settle(index: int, topic: str, level: str, num: int, future: asyncio.Future) -> None:
+            questions = sets.get(index)
+            if questions is not None and len(questions) >= num:
+                self.batched_requests += 1
+                result: Any = questions[:num]
+            else:
+                if future.done():
+                    return  # the caller gave up (deadline or cancellation), so nobody needs a fallback
+                if len(batch) > 1:
+                    self.fallbacks += 1
+                self.upstream_calls += 1
+                fallback = asyncio.ensure_future(request_mcqs(topic, level, num))
+                # Abort the fallback if the caller gives up while it runs
+                future.add_done_callback(lambda _: fallback.cancel())
+                try:
+                    result = await fallback
+                except asyncio.CancelledError:
+                    if fallback.cancelled() and future.done():
+                        return
+                    raise
+                except Exception as e:
+                    result = e
+            if not future.done():
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+        await asyncio.gather(*(settle(i, *entry) for i, entry in enumerate(batch)))
+
+    def stats(self) -> Dict[str, Any]:
+        """Batching counters for the metrics tool."""
+        return {
+            "enabled": self.window > 0,
+            "upstream_calls": self.upstream_calls,
+            "batched_requests": self.batched_requests,
+            "fallbacks": self.fallbacks,
+        }
+
+mcq_batcher = MCQBatcher(
+    window=float(os.getenv("EDUCHAIN_BATCH_WINDOW_MS", "0")) / 1000,
+    max_requests=int(os.getenv("EDUCHAIN_BATCH_MAX_REQUESTS", "8")),
+    max_questions=int(os.getenv("EDUCHAIN_BATCH_MAX_QUESTIONS", "5")),
+)
+
+class RequestHedger:
+    """
+    Hedges slow MCQ requests with a duplicate call.
+
+    Recent successful latencies are kept per size bucket (1, 2, 3-4, 5-8, ...
+    questions), since a call's fixed cost dominates small requests and
+    per-question scaling would hedge every one of them. When a request is still
+    running after the <percentile> latency of its bucket, a second identical
+    request is started; the first valid response wins and the other is
+    cancelled. Hedges are capped at <budget> per primary request, which bounds
+    the extra spend.
+
+    Args:
+        percentile (float): Latency percentile that triggers a hedge; 0 disables hedging.
+        budget (float): Maximum hedged calls per primary call, e.g. 0.1 for 10% extra.
+        min_samples (int): Latencies needed in a bucket before its requests are hedged.
+        window (int): Number of recent latencies kept per bucket.
+    """
+
+    def __init__(self, percentile: float = 0.0, budget: float = 0.1, min_samples: int = 20, window: int = 200):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.window = window
+        self.latencies: Dict[int, deque[float]] = {}  # size bucket -> recent seconds per request
+        self.primaries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @staticmethod
+    def bucket(num: int) -> int:
+        """Size bucket of a request for <num> questions: sizes up to the same power of two share one."""
+        return (max(1, num) - 1).bit_length()
+
+    def threshold(self, num: int) -> float | None:
+        """Seconds after which a request for <num> questions gets hedged, or None if it should not be."""
+        samples = self.latencies.get(self.bucket(num), ())
+        if self.percentile <= 0 or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+    async def run(self, num: int, request: Callable[[], Awaitable[list[dict]]]) -> list[dict]:
+        """Run <request>, hedging it once if it is slow and the budget allows."""
+        self.primaries += 1
+        started = time.monotonic()
+        primary = asyncio.ensure_future(request())
+        pending = {primary}
+        try:
+            delay = self.threshold(num)
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done and self.hedges < self.budget * self.primaries:
+                    self.hedges += 1
+                    pending.add(asyncio.ensure_future(request()))
+            error: Exception | None = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    questions = task.result()
+                    if questions or not pending:
+                        self.hedge_wins += task is not primary
+                        if questions:
+                            self.latencies.setdefault(self.bucket(num), deque(maxlen=self.window)).append(
+                                time.monotonic() - started
+                            )
+                        return questions
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hedging counters for the metrics tool."""
+        return {
+            "enabled": self.percentile > 0,
+            "primaries": self.primaries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "extra_call_ratio": round(self.hedges / self.primaries, 3) if self.primaries else 0.0,
+        }
+
+mcq_hedger = RequestHedger(
+    percentile=float(os.getenv("EDUCHAIN_HEDGE_PERCENTILE", "0")),
+    budget=float(os.getenv("EDUCHAIN_HEDGE_BUDGET", "0.1")),
+)
+
+async def generate_mcq_chunk(
+    topic: str, level: str, num: int, on_question: Callable[[dict], Awaitable[None]] | None = None
+) -> list[dict]:
+    """
+    Generate <num> MCQs with a single model call (hedged when slow, unless
+    streamed or batched) and report the outcome to the tuner.
+    """
+    started = time.monotonic()
     try:
-        return json.loads(cleaned_string)
-    except json.JSONDecodeError as e:
-        # If still not valid JSON, it's better to raise an error
-        # or provide more specific feedback than just returning None silently.
-        raise ValueError(f"Could not decode JSON after cleaning: {e}. Cleaned string: '{cleaned_string}'")
+        if on_question is not None:
+            questions = await request_mcqs(topic, level, num, on_question)
+        elif mcq_batcher.accepts(num):
+            questions = await mcq_batcher.submit(topic, level, num)
+        else:
+            questions = await mcq_hedger.run(num, lambda: request_mcqs(topic, level, num))
+    except Exception:
+        chunk_tuner.record(num, 0, time.monotonic() - started)
+        raise
+    chunk_tuner.record(num, len(questions), time.monotonic() - started)
+    return questions
 
-mcp = FastMCP("Educhain MCP Server")
+async def create_mcqs(
+    topic: str, level: str, num: int, on_question: Callable[[dict], Awaitable[None]] | None = None
+) -> list[dict]:
+    """
+    Generate <num> MCQs, bypassing every cache.
+
+    Requests larger than the tuned chunk size are split into chunks generated
+    in parallel. Results are merged without duplicate questions, and only the
+    shortfall left by failed or truncated chunks is requested again.
+    Questions that near-duplicate anything already banked for the topic are
+    dropped, and replacements are requested only to fill that gap.
+
+    With <on_question>, every chunk is streamed and each accepted question is
+    passed to the callback the moment it arrives.
+    """
+    questions: list[dict] = []
+    error: Exception | None = None
+    await duplicate_index.prepare(topic, level)
+
+    async def accept(q: dict) -> None:
+        if len(questions) < num and q.get("question") and duplicate_index.admit(topic, level, q["question"]):
+            questions.append(q)
+            await on_question(q)
+
+    for _ in range(MAX_CHUNK_ROUNDS):
+        remaining = num - len(questions)
+        if remaining <= 0:
+            break
+        chunks = chunk_tuner.plan(remaining)
+        results = await asyncio.gather(
+            *(generate_mcq_chunk(topic, level, size, accept if on_question else None) for size in chunks),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                error = result
+                continue
+            if on_question is not None:
+                continue  # already accepted while streaming
+            for q in result:
+                # Surplus questions are not indexed, since they are never returned or banked
+                if len(questions) < num and q.get("question") and duplicate_index.admit(topic, level, q["question"]):
+                    questions.append(q)
+    if not questions and error is not None:
+        raise error
+    return questions[:num]
+
+async def stock_mcqs(
+    topic: str, level: str, num: int, on_question: Callable[[dict], Awaitable[None]] | None = None
+) -> list[dict]:
+    """
+    Serve unseen MCQs from the question bank and generate only the shortfall.
+    If generating the shortfall fails, the stock questions are put back
+    unless they were already streamed to the client.
+    """
+    questions = question_bank.take_unseen(topic, level, num)
+    if on_question is not None:
+        for q in questions:
+            await on_question(q)
+    if len(questions) < num:
+        try:
+            fresh = await create_mcqs(topic, level, num - len(questions), on_question)
+        except BaseException:
+            if on_question is None:
+                question_bank.restock(topic, level, questions)
+            raise
+        question_bank.add(topic, level, fresh)
+        questions.extend(fresh)
+    return questions
 
 @mcp.tool()
-def generate_mcqs(topic: str, level: str = "Beginner", num: int = 5) -> list[dict]:
+async def generate_mcqs(
+    topic: str, level: str = "Beginner", num: int = 5, bypass_cache: bool = False,
+    timeout_seconds: float | None = None, ctx: Context = None,
+) -> list[dict]:
     """
     Create <num> multiple-choice questions for <topic> at the given difficulty <level>.
     Returns a list of question dictionaries that Claude can read.
+    Unseen questions from the question bank are used before generating new ones.
+    Set <bypass_cache> to skip the in-memory result cache. When the client sends
+    a progress token, questions are streamed and each one is delivered as a
+    progress notification as soon as it is ready; if <timeout_seconds> runs out
+    mid-stream, the questions received so far are returned.
     """
-    return client.qna_engine.generate_questions(
-        topic=topic, num=num, question_type="Multiple Choice", difficulty_level=level
-    ).model_dump()["questions"]
+    on_question = None
+    if ctx is not None and ctx.request_context.meta and ctx.request_context.meta.progressToken is not None:
+        delivered = 0
+
+        async def on_question(question: dict) -> None:
+            nonlocal delivered
+            delivered += 1
+            await ctx.report_progress(delivered, num, message=json.dumps(question))
+
+    key = ("mcqs", normalize_arg(topic), normalize_arg(level), num)
+    with deadline(tool_timeout("generate_mcqs", timeout_seconds)):
+        return await cached_or_stale(
+            key,
+            lambda: stock_mcqs(topic, level, num, on_question),
+            bypass=bypass_cache,
+            cache_if=lambda questions: len(questions) >= num,
+            fallback=lambda: question_bank.existing(topic, level, num),
+            refresh=lambda: stock_mcqs(topic, level, num),
+        )
+
+class MCQSpec(BaseModel):
+    """One entry of a generate_mcqs_batch request."""
+    topic: str
+    level: str = "Beginner"
+    num: int = 5
 
 @mcp.tool()
-def generate_lesson_plan(topic: str, grade_level: str = "Middle School", duration: int = 60) -> Dict[str, Any]:
+async def generate_mcqs_batch(
+    specs: list[MCQSpec], max_parallel: int = 5, timeout_seconds: float | None = None
+) -> Dict[str, Any]:
+    """
+    Create MCQs for several topics at once, e.g. a whole unit quiz in one call.
+    Up to <max_parallel> specs are generated concurrently. Results are keyed
+    "<topic> | <level> | <num>"; each maps to {"questions": [...]} or, if that
+    spec failed, {"error": "..."} without affecting the other specs. Repeated
+    specs (same topic, level and num, ignoring case and spacing) are rejected;
+    ask for a larger <num> instead.
+    """
+    seen: set = set()
+    for spec in specs:
+        key = (normalize_arg(spec.topic), normalize_arg(spec.level), spec.num)
+        if key in seen:
+            return {"error": f"Duplicate spec: {spec.topic} | {spec.level} | {spec.num}"}
+        seen.add(key)
+    slots = asyncio.Semaphore(max(1, max_parallel))
+
+    async def run(spec: MCQSpec) -> Dict[str, Any]:
+        async with slots:
+            try:
+                return {"questions": await generate_mcqs(spec.topic, spec.level, spec.num)}
+            except Exception as e:
+                return {"error": f"Failed to generate MCQs: {str(e)}"}
+
+    with deadline(tool_timeout("generate_mcqs_batch", timeout_seconds)):
+        results = await asyncio.gather(*(run(spec) for spec in specs))
+    return {f"{spec.topic} | {spec.level} | {spec.num}": result for spec, result in zip(specs, results)}
+
+@mcp.tool()
+async def generate_lesson_plan(
+    topic: str, grade_level: str = "Middle School", duration: int = 60, bypass_cache: bool = False,
+    sectioned: bool = False, timeout_seconds: float | None = None, sla_seconds: float | None = None,
+    ctx: Context = None,
+) -> Dict[str, Any]:
     """
     Generate a comprehensive lesson plan for the given topic using Gemini directly.
+    Set <bypass_cache> to force a fresh generation. Set <sectioned> to generate
+    the independent sections concurrently; a malformed section is then
+    regenerated on its own instead of failing the whole plan. When the client
+    sends a progress token, each section is delivered as a progress
+    notification as soon as it has been generated, and a plan cut short by
+    <timeout_seconds> keeps the sections that arrived. With <sla_seconds>
+    (default EDUCHAIN_LESSON_PLAN_SLA_SECONDS), a plan that is not ready in
+    time is answered with the last cached plan ("stale": true; skipped with
+    <bypass_cache>) or the template (with an "error"), and the real plan is
+    cached for the next request.
+    """
+    on_section = None
+    if ctx is not None and ctx.request_context.meta and ctx.request_context.meta.progressToken is not None:
+        sections_done = 0
+
+        async def on_section(name: str, value: Any) -> None:
+            nonlocal sections_done
+            sections_done += 1
+            await ctx.report_progress(sections_done, len(LessonPlan.model_fields), message=json.dumps({name: value}))
+
+    key = ("lesson_plan", normalize_arg(topic), normalize_arg(grade_level), duration)
+    create = create_sectioned_lesson_plan if sectioned else create_lesson_plan
+    timeout = tool_timeout("generate_lesson_plan", timeout_seconds)
+    sla = sla_seconds if sla_seconds and sla_seconds > 0 else LESSON_PLAN_SLA_SECONDS
+    if sla <= 0 or sla >= timeout:
+        with deadline(timeout):
+            return await cached_or_stale(
+                key,
+                lambda: create(topic, grade_level, duration, on_section=on_section),
+                bypass=bypass_cache,
+                cache_if=lambda plan: "error" not in plan,
+                refresh=lambda: create(topic, grade_level, duration),
+            )
+
+    answered = False
+
+    async def forward(name: str, value: Any) -> None:
+        # Generation outlives the request; stop streaming once the caller has its answer
+        if not answered:
+            await on_section(name, value)
+
+    async def generate() -> Dict[str, Any]:
+        with deadline(timeout):
+            return await cached_or_stale(
+                key,
+                lambda: create(topic, grade_level, duration, on_section=forward if on_section else None),
+                bypass=bypass_cache,
+                cache_if=lambda plan: "error" not in plan,
+            )
+
+    try:
+        return await lesson_plan_within_sla(
+            key,
+            generate,
+            sla,
+            lambda: lesson_plan_template(
+                topic, grade_level, duration,
+                f"No lesson plan within the {sla:g}s SLA; returned the template while one is generated"
+            ),
+            bypass=bypass_cache,
+        )
+    finally:
+        answered = True
+
+class LessonPhase(BaseModel):
+    duration: str
+    activities: list[str]
+
+class LessonStructure(BaseModel):
+    introduction: LessonPhase
+    main_content: LessonPhase
+    conclusion: LessonPhase
+    assessment: LessonPhase
+
+class LessonPlan(BaseModel):
+    """Lesson plan schema, sent to Gemini as the response schema and used to validate its output."""
+    title: str
+    topic: str
+    grade_level: str
+    duration: str
+    learning_objectives: list[str]
+    materials_needed: list[str]
+    lesson_structure: LessonStructure
+    key_concepts: list[str]
+    homework_assignment: str
+    additional_resources: list[str]
+
+# How each lesson plan was produced: "structured" (valid schema output),
+# "repaired" (valid after JSON repair), "fallback" (template), "partial"
+# (streamed sections cut off by the deadline) or "failed".
+lesson_plan_outcomes: Dict[str, int] = {"structured": 0, "repaired": 0, "fallback": 0, "partial": 0, "failed": 0}
+
+def lesson_plan_stats() -> Dict[str, Any]:
+    """Lesson plan outcome counters and fallback rate for the metrics tool."""
+    total = sum(lesson_plan_outcomes.values())
+    return {
+        **lesson_plan_outcomes,
+        "fallback_rate": round(lesson_plan_outcomes["fallback"] / total, 3) if total else 0.0,
+        "sla": dict(lesson_plan_sla),
+    }
+
+def lesson_plan_template(topic: str, grade_level: str, duration: int, error: str) -> Dict[str, Any]:
+    """Generic lesson plan for <topic>, flagged with <error> so it is never cached."""
+    minutes = phase_minutes(duration)
+    return {
+        "title": f"Lesson Plan: {topic}",
+        "topic": topic,
+        "grade_level": grade_level,
+        "duration": duration,
+        "learning_objectives": [
+            f"Understand the basics of {topic}",
+            f"Apply knowledge of {topic} in practical scenarios",
+            f"Analyze and evaluate {topic} concepts"
+        ],
+        "materials_needed": ["Whiteboard", "Textbook", "Handouts"],
+        "lesson_structure": {
+            "introduction": {
+                "duration": f"{minutes['introduction']} minutes",
+                "activities": [f"Introduction to {topic}"]
+            },
+            "main_content": {
+                "duration": f"{minutes['main_content']} minutes",
+                "activities": [f"Detailed explanation of {topic}", f"Interactive {topic} activities"]
+            },
+            "conclusion": {
+                "duration": f"{minutes['conclusion']} minutes",
+                "activities": ["Summary and review"]
+            },
+            "assessment": {
+                "duration": f"{minutes['assessment']} minutes",
+                "activities": ["Quick quiz or discussion"]
+            }
+        },
+        "key_concepts": [f"Key concepts related to {topic}"],
+        "homework_assignment": f"Complete exercises related to {topic}",
+        "additional_resources": ["Online resources", "Recommended readings"],
+        "error": error
+    }
+
+LESSON_PLAN_SLA_SECONDS = float(os.getenv("EDUCHAIN_LESSON_PLAN_SLA_SECONDS", "0"))
+
+# How lesson plan requests in SLA mode were answered: "met" (real plan in
+# time), "stale" (last cached plan) or "template".
+lesson_plan_sla: Dict[str, int] = {"met": 0, "stale": 0, "template": 0}
+_plan_generations: Dict[Any, asyncio.Task] = {}
+
+async def lesson_plan_within_sla(
+    key, generate: Callable[[], Awaitable[Dict[str, Any]]], sla: float, template: Callable[[], Dict[str, Any]],
+    bypass: bool = False,
+) -> Dict[str, Any]:
+    """
+    Return the plan from <generate>() if it is ready within <sla> seconds.
+
+    Otherwise return the last plan cached for <key> (even if expired) marked
+    "stale": True, or else <template>(); with <bypass> the cache is skipped
+    and the template is returned. Generation keeps running in the background
+    and <generate> caches its result, so the next identical request gets the
+    real plan. Concurrent requests for the same key (and <bypass>) share one
+    generation.
+    """
+    generation = (key, bypass)
+    task = _plan_generations.get(generation)
+    if task is None:
+        # Started without the caller's context, so the SLA does not cut the generation short
+        task = asyncio.get_running_loop().create_task(generate(), context=contextvars.Context())
+        _plan_generations[generation] = task
+
+        def finished(done: asyncio.Task) -> None:
+            if _plan_generations.get(generation) is done:
+                del _plan_generations[generation]
+            if not done.cancelled():
+                done.exception()
+
+        task.add_done_callback(finished)
+    try:
+        with deadline(sla):
+            async with within_deadline():
+                plan = copy.deepcopy(await asyncio.shield(task))
+        lesson_plan_sla["met"] += 1
+        return plan
+    except TimeoutError:
+        pass
+    stale = None if bypass else result_cache.last_value(key)
+    if stale:
+        lesson_plan_sla["stale"] += 1
+        return mark_stale(stale)
+    lesson_plan_sla["template"] += 1
+    return template()
+
+async def create_lesson_plan(
+    topic: str, grade_level: str, duration: int,
+    on_section: Callable[[str, Any], Awaitable[None]] | None = None,
+) -> Dict[str, Any]:
+    """
+    Generate a lesson plan with Gemini, falling back to a template on failure.
+
+    With <on_section>, the response is streamed and each top-level section is
+    passed to the callback as soon as its JSON closes.
     """
     prompt = f"""
     Create a detailed lesson plan for the topic: "{topic}"
     Grade Level: {grade_level}
     Duration: {duration} minutes
 
-    Please provide the lesson plan in the following JSON format:
-    {{
-        "title": "Lesson title",
-        "topic": "{topic}",
-        "grade_level": "{grade_level}",
-        "duration": "{duration}",
-        "learning_objectives": [
-            "Objective 1",
-            "Objective 2",
-            "Objective 3"
-        ],
-        "materials_needed": [
-            "Material 1",
-            "Material 2",
-            "Material 3"
-        ],
-        "lesson_structure": {{
-            "introduction": {{
-                "duration": "10 minutes",
-                "activities": [
-                    "Activity description"
-                ]
-            }},
-            "main_content": {{
-                "duration": "35 minutes",
-                "activities": [
-                    "Activity 1 description",
-                    "Activity 2 description"
-                ]
-            }},
-            "conclusion": {{
-                "duration": "10 minutes",
-                "activities": [
-                    "Wrap-up activity"
-                ]
-            }},
-            "assessment": {{
-                "duration": "5 minutes",
-                "activities": [
-                    "Assessment method"
-                ]
-            }}
-        }},
-        "key_concepts": [
-            "Concept 1",
-            "Concept 2",
-            "Concept 3"
-        ],
-        "homework_assignment": "Description of homework or follow-up activities",
-        "additional_resources": [
-            "Resource 1",
-            "Resource 2"
-        ]
-    }}
-
-    Make sure the response is valid JSON only, no additional text.
+    Split the duration across the introduction, main content, conclusion and
+    assessment phases, and give at least three learning objectives, materials
+    and key concepts.
     """
 
     try:
-        # Generate lesson plan using Gemini
-        response = get_gemini_response(prompt)
-        
-        # Extract the content from the response
-        content = response #.content if hasattr(response, 'content') else str(response)
+        # Generate lesson plan using Gemini's JSON mode with the LessonPlan schema
+        if on_section is None:
+            content = await get_gemini_response(prompt, response_schema=LessonPlan)
+        else:
+            parser = StreamingJSONParser()
+            received: Dict[str, Any] = {}
+
+            async def forward(chunk: str) -> None:
+                for (name,), value in parser.feed(chunk):
+                    received[name] = value
+                    await on_section(name, value)
+
+            try:
+                content = await stream_gemini_response(prompt, forward, response_schema=LessonPlan)
+            except TimeoutError:
+                if not received:
+                    raise
+                # Keep what streamed in before the deadline
+                lesson_plan_outcomes["partial"] += 1
+                return {
+                    **received,
+                    "error": f"Deadline exceeded after {len(received)} of {len(LessonPlan.model_fields)} sections"
+                }
         
-        # Parse the JSON response
-        lesson_plan = json.loads(content)
+        # Validate straight from the JSON text with the compiled schema validator
+        try:
+            lesson_plan = LessonPlan.model_validate_json(content).model_dump()
+            lesson_plan_outcomes["structured"] += 1
+            return lesson_plan
+        except ValueError:
+            # Parse the JSON response, tolerating fences and common LLM defects
+            lesson_plan = clean_and_parse_json(content, expect=dict)
         
         # Validate that it's a dictionary
         if isinstance(lesson_plan, dict):
+            lesson_plan = LessonPlan.model_validate(lesson_plan).model_dump()
+            lesson_plan_outcomes["repaired"] += 1
             return lesson_plan
         else:
             # Fallback if JSON parsing fails
-            return {
-                "title": f"Lesson Plan: {topic}",
-                "topic": topic,
-                "grade_level": grade_level,
-                "duration": duration,
-                "learning_objectives": [
-                    f"Understand the basics of {topic}",
-                    f"Apply knowledge of {topic} in practical scenarios",
-                    f"Analyze and evaluate {topic} concepts"
-                ],
-                "materials_needed": ["Whiteboard", "Textbook", "Handouts"],
-                "lesson_structure": {
-                    "introduction": {
-                        "duration": "10 minutes",
-                        "activities": [f"Introduction to {topic}"]
-                    },
-                    "main_content": {
-                        "duration": "35 minutes",
-                        "activities": [f"Detailed explanation of {topic}", f"Interactive {topic} activities"]
-                    },
-                    "conclusion": {
-                        "duration": "10 minutes",
-                        "activities": ["Summary and review"]
-                    },
-                    "assessment": {
-                        "duration": "5 minutes",
-                        "activities": ["Quick quiz or discussion"]
-                    }
-                },
-                "key_concepts": [f"Key concepts related to {topic}"],
-                "homework_assignment": f"Complete exercises related to {topic}",
-                "additional_resources": ["Online resources", "Recommended readings"],
-                "error": "Generated with fallback structure"
-            }
+            lesson_plan_outcomes["fallback"] += 1
+            return lesson_plan_template(topic, grade_level, duration, "Generated with fallback structure")
             
-    except json.JSONDecodeError as e:
-        # Return a structured fallback if JSON parsing fails
+    except ValueError as e:
+        # Return a structured fallback if JSON parsing or schema validation fails
+        lesson_plan_outcomes["fallback"] += 1
+        return lesson_plan_template(topic, grade_level, duration, f"JSON parsing failed: {str(e)}")
+    except Exception as e:
+        # Return error information
+        lesson_plan_outcomes["failed"] += 1
         return {
             "title": f"Lesson Plan: {topic}",
             "topic": topic,
             "grade_level": grade_level,
             "duration": duration,
-            "learning_objectives": [
-                f"Understand the fundamentals of {topic}",
-                f"Apply {topic} concepts in real-world scenarios",
-                f"Evaluate and analyze {topic} information"
-            ],
-            "materials_needed": ["Whiteboard", "Presentation slides", "Student handouts"],
-            "lesson_structure": {
-                "introduction": {
-                    "duration": "10 minutes",
-                    "activities": [f"Warm-up activity introducing {topic}"]
-                },
-                "main_content": {
-                    "duration": "35 minutes",
-                    "activities": [
-                        f"Lecture on {topic} fundamentals",
-                        f"Interactive {topic} demonstration",
-                        f"Group activity exploring {topic}"
-                    ]
-                },
-                "conclusion": {
-                    "duration": "10 minutes",
-                    "activities": ["Review key points", "Q&A session"]
-                },
-                "assessment": {
-                    "duration": "5 minutes",
-                    "activities": ["Exit ticket or quick assessment"]
-                }
-            },
-            "key_concepts": [f"Core principles of {topic}"],
-            "homework_assignment": f"Research and write about {topic} applications",
-            "additional_resources": ["Textbook chapters", "Online videos", "Practice worksheets"],
-            "error": f"JSON parsing failed: {str(e)}"
+            "error": f"Failed to generate lesson plan: {str(e)}"
         }
-    except Exception as e:
-        # Return error information
+
+class LessonFoundations(BaseModel):
+    title: str
+    learning_objectives: list[str]
+    materials_needed: list[str]
+
+class LessonFollowUp(BaseModel):
+    key_concepts: list[str]
+    homework_assignment: str
+    additional_resources: list[str]
+
+# Share of the lesson given to each phase; main_content takes the remainder.
+PHASE_SHARES = {"introduction": 0.15, "conclusion": 0.15, "assessment": 0.10}
+SECTION_ATTEMPTS = 3
+
+def phase_minutes(duration: int) -> Dict[str, int]:
+    """Split <duration> minutes across the four lesson phases."""
+    minutes = {phase: max(1, round(duration * share)) for phase, share in PHASE_SHARES.items()}
+    return {"introduction": minutes["introduction"], "main_content": max(1, duration - sum(minutes.values())),
+            "conclusion": minutes["conclusion"], "assessment": minutes["assessment"]}
+
+async def generate_section(prompt: str, schema: type[BaseModel]) -> tuple[Dict[str, Any], bool]:
+    """
+    Generate one lesson plan section, regenerating only this section when its
+    output cannot be validated against <schema>.
+
+    Returns:
+        tuple: The section as a dict, and whether it needed repair or a retry.
+
+    Raises:
+        The last error once SECTION_ATTEMPTS generations have failed.
+    """
+    error: Exception | None = None
+    for attempt in range(SECTION_ATTEMPTS):
+        try:
+            content = await get_gemini_response(prompt, response_schema=schema)
+            try:
+                return schema.model_validate_json(content).model_dump(), attempt > 0
+            except ValueError:
+                return schema.model_validate(clean_and_parse_json(content, expect=dict)).model_dump(), True
+        except Exception as e:
+            error = e
+    raise error
+
+async def create_sectioned_lesson_plan(
+    topic: str, grade_level: str, duration: int,
+    on_section: Callable[[str, Any], Awaitable[None]] | None = None,
+) -> Dict[str, Any]:
+    """
+    Generate a lesson plan as six independent sections in parallel: objectives
+    and materials, each of the four lesson phases, and concepts, homework and
+    resources. Each section is validated and retried on its own; a section that
+    still fails is filled from the template and the plan is flagged with an
+    "error" so it is not cached.
+    """
+    context = f'Topic: "{topic}"\n    Grade Level: {grade_level}\n    Lesson duration: {duration} minutes'
+    minutes = phase_minutes(duration)
+    template = lesson_plan_template(topic, grade_level, duration, "")
+    fallbacks: Dict[str, Dict[str, Any]] = {
+        "foundations": {name: template[name] for name in LessonFoundations.model_fields},
+        **template["lesson_structure"],
+        "follow_up": {name: template[name] for name in LessonFollowUp.model_fields},
+    }
+    requests: Dict[str, tuple[str, type[BaseModel]]] = {
+        "foundations": (f"""
+    Write the title, at least three learning objectives and the materials needed
+    for a lesson plan.
+    {context}
+    """, LessonFoundations),
+        **{phase: (f"""
+    Write the {phase.replace("_", " ")} phase of a lesson plan: its duration
+    ("{minutes[phase]} minutes") and a list of concrete activities.
+    {context}
+    """, LessonPhase) for phase in LessonStructure.model_fields},
+        "follow_up": (f"""
+    Write the key concepts (at least three), a homework assignment and additional
+    resources for a lesson plan.
+    {context}
+    """, LessonFollowUp),
+    }
+
+    plan: Dict[str, Any] = {"topic": topic, "grade_level": grade_level, "duration": f"{duration} minutes"}
+    structure: Dict[str, Any] = {}
+    failed: list[str] = []
+    repaired = False
+
+    async def emit(values: Dict[str, Any]) -> None:
+        if on_section is not None:
+            for name, value in values.items():
+                await on_section(name, value)
+
+    async def build(name: str) -> None:
+        nonlocal repaired
+        try:
+            section, was_repaired = await generate_section(*requests[name])
+            repaired = repaired or was_repaired
+        except Exception as e:
+            failed.append(f"{name} ({e})")
+            section = fallbacks[name]
+        if name in LessonStructure.model_fields:
+            structure[name] = section
+            if len(structure) == len(LessonStructure.model_fields):
+                plan["lesson_structure"] = {phase: structure[phase] for phase in LessonStructure.model_fields}
+                await emit({"lesson_structure": plan["lesson_structure"]})
+        else:
+            plan.update(section)
+            await emit(section)
+
+    await emit(plan)
+    await asyncio.gather(*(build(name) for name in requests))
+
+    if len(failed) == len(requests):
+        lesson_plan_outcomes["failed"] += 1
         return {
             "title": f"Lesson Plan: {topic}",
             "topic": topic,
             "grade_level": grade_level,
             "duration": duration,
-            "error": f"Failed to generate lesson plan: {str(e)}"
+            "error": f"Failed to generate lesson plan: {'; '.join(failed)}"
+        }
+    lesson_plan = {field: plan[field] for field in LessonPlan.model_fields}
+    if failed:
+        lesson_plan_outcomes["fallback"] += 1
+        lesson_plan["error"] = f"Sections generated with fallback structure: {'; '.join(failed)}"
+    else:
+        lesson_plan_outcomes["repaired" if repaired else "structured"] += 1
+    return lesson_plan
+
+def section_schema(path: list[str]) -> Any:
+    """Type of the lesson plan section at <path> (e.g. ["lesson_structure", "assessment"]), or None."""
+    annotation: Any = LessonPlan
+    for name in path:
+        fields = getattr(annotation, "model_fields", None)
+        if not fields or name not in fields:
+            return None
+        annotation = fields[name].annotation
+    return annotation
+
+def json_patch(old: Any, new: Any, pointer: str) -> list[Dict[str, Any]]:
+    """JSON-Patch (RFC 6902) operations turning <old> into <new> at JSON pointer <pointer>."""
+    if old == new:
+        return []
+    if not (isinstance(old, dict) and isinstance(new, dict)):
+        return [{"op": "replace", "path": pointer, "value": new}]
+    ops = []
+    for key in old.keys() | new.keys():
+        child = f"{pointer}/{str(key).replace('~', '~0').replace('/', '~1')}"
+        if key not in new:
+            ops.append({"op": "remove", "path": child})
+        elif key not in old:
+            ops.append({"op": "add", "path": child, "value": new[key]})
+        else:
+            ops.extend(json_patch(old[key], new[key], child))
+    return sorted(ops, key=lambda op: op["path"])
+
+@mcp.tool()
+async def refine_lesson_plan(
+    plan: Dict[str, Any], section: str, instruction: str, timeout_seconds: float | None = None
+) -> Dict[str, Any]:
+    """
+    Rewrite one section of an existing lesson <plan> according to <instruction>,
+    e.g. section "lesson_structure/assessment" or "homework_assignment" with
+    "make it a group project". Only that section and the plan's topic, grade
+    level and duration are sent to Gemini. Returns {"patch": [...JSON-Patch
+    operations...], "plan": the merged plan}, or {"error": "..."}.
+    """
+    path = [name for name in re.split(r"[/.]", section) if name]
+    schema = section_schema(path)
+    current: Any = plan
+    for name in path:
+        current = current.get(name) if isinstance(current, dict) else None
+    if not path or schema is None or current is None:
+        return {"error": f"Unknown or missing lesson plan section: {section!r}"}
+
+    edit = create_model("SectionEdit", value=(schema, ...))
+    prompt = f"""
+    Revise one section of a lesson plan.
+    Topic: "{plan.get("topic", "")}"
+    Grade Level: {plan.get("grade_level", "")}
+    Duration: {plan.get("duration", "")}
+
+    Section "{'/'.join(path)}" currently is:
+    {json.dumps(current)}
+
+    Instruction: {instruction}
+
+    Return the revised section as "value", in the same shape.
+    """
+    try:
+        with deadline(tool_timeout("refine_lesson_plan", timeout_seconds)):
+            content = await get_gemini_response(prompt, response_schema=edit)
+        try:
+            revised = edit.model_validate_json(content).model_dump()["value"]
+        except ValueError:
+            revised = edit.model_validate(clean_and_parse_json(content, expect=dict)).model_dump()["value"]
+    except Exception as e:
+        return {"error": f"Failed to refine lesson plan: {str(e)}"}
+
+    merged = copy.deepcopy(plan)
+    target = merged
+    for name in path[:-1]:
+        target = target[name]
+    target[path[-1]] = revised
+    pointer = "".join(f"/{name.replace('~', '~0').replace('/', '~1')}" for name in path)
+    return {"patch": json_patch(current, revised, pointer), "plan": merged}
+
+class Flashcard(BaseModel):
+    """Compact output schema for flashcard generation: no options, no explanation."""
+    question: str
+    answer: str
+
+async def create_flashcards(topic: str, level: str, num: int) -> list[dict]:
+    """
+    Generate <num> flashcards directly with a compact question/answer schema.
+
+    Much cheaper than deriving cards from full MCQs, since the model does not
+    write options or explanations that would be thrown away.
+    """
+    response = await model_call(
+        lambda t: t.genai.aio.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=(
+                f"Write {num} flashcards for a {level} learner on the topic: {topic}. "
+                "Each card has one short question and its concise answer."
+            ),
+            config={"response_mime_type": "application/json", "response_schema": list[Flashcard]},
+        )
+    )
+    return [card.model_dump() for card in (response.parsed or [])][:num]
+
+@mcp.tool()
+async def generate_flashcards(
+    topic: str, level: str = "Beginner", num: int = 5, timeout_seconds: float | None = None
+) -> Dict[str, Any]:
+    """
+    Create <num> question/answer flashcards for <topic> at the given difficulty <level>.
+    MCQs already generated for the same topic and level are reused; only the
+    remainder is generated. The result reports how many cards came from each.
+    """
+    cards = [
+        {"question": q["question"], "answer": q["answer"]}
+        for q in question_bank.existing(topic, level, num)
+    ]
+    reused = len(cards)
+    if reused < num:
+        with deadline(tool_timeout("generate_flashcards", timeout_seconds)):
+            cards.extend(await create_flashcards(topic, level, num - reused))
+    return {"flashcards": cards, "reused": reused, "generated": len(cards) - reused}
+
+class LessonPlanSpec(BaseModel):
+    """One lesson plan of a generation job."""
+    topic: str
+    grade_level: str = "Middle School"
+    duration: int = 60
+    sectioned: bool = False
+
+class CircuitWait(Exception):
+    """A job unit hit the open circuit breaker and should be retried once it closes."""
+
+class UnitShortfall(RuntimeError):
+    """A job unit produced fewer items than it asked for; <questions> are the ones it did get."""
+
+    def __init__(self, message: str, questions: list[dict]):
+        super().__init__(message)
+        self.questions = questions
+
+class JobQueue:
+    """
+    Persistent queue of bulk generation jobs, worked off by a pool of tasks.
+
+    A job is a list of MCQ and lesson plan specs. It is split into units (one
+    lesson plan, or up to <chunk_size> MCQs of a spec) that the workers run
+    independently, so one large spec is generated in parallel and a failed
+    unit is retried on its own. Jobs, units and results live in SQLite: a
+    unit's items are written in the same transaction that marks it done.
+    Every server process sharing the database works off the same queue. A
+    unit is claimed in a single statement and held on a lease that its
+    process renews while it runs; once a lease runs out (its process died),
+    the unit is queued again.
+
+    Args:
+        path (str): SQLite database file (created if missing).
+        workers (int): Number of units generated concurrently.
+        chunk_size (int): Maximum MCQs per unit.
+        attempts (int): Tries per unit before it is marked failed.
+        retention (float): Seconds a finished job is kept before it is deleted.
+        lease (float): Seconds a claimed unit stays reserved without renewal.
+    """
+
+    def __init__(
+        self, path: str, workers: int = 4, chunk_size: int = 25, attempts: int = 3, retention: float = 7 * 86400,
+        lease: float = 60.0,
+    ):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.attempts = attempts
+        self.retention = retention
+        self.lease = lease
+        self.owner = uuid.uuid4().hex  # identifies this process's leases
+        self._tasks: list[asyncio.Task] = []
+        self._renewal: asyncio.Task | None = None
+        self._wake: asyncio.Event | None = None
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                specs TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS job_units (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                spec INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                owner TEXT,
+                lease_until REAL,
+                PRIMARY KEY (job_id, seq)
+            );
+            CREATE INDEX IF NOT EXISTS idx_job_units_status ON job_units (status);
+            CREATE TABLE IF NOT EXISTS job_items (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq, position)
+            );
+            """
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(job_units)")}
+        if "lease_until" not in columns:
+            self._db.execute("ALTER TABLE job_units ADD COLUMN owner TEXT")
+            self._db.execute("ALTER TABLE job_units ADD COLUMN lease_until REAL")
+        self.completed_units = 0
+        self.failed_units = 0
+
+    def submit(self, mcqs: list[MCQSpec], lesson_plans: list[LessonPlanSpec]) -> str:
+        """Store a job and its units, wake the workers, and return the job id."""
+        job_id = uuid.uuid4().hex
+        specs = [{"mcqs": spec.model_dump()} for spec in mcqs] + [{"lesson_plan": spec.model_dump()} for spec in lesson_plans]
+        units = []
+        for index, spec in enumerate(specs):
+            if "mcqs" in spec:
+                mcq = spec["mcqs"]
+                for start in range(0, mcq["num"], self.chunk_size):
+                    units.append((index, "mcqs", {**mcq, "num": min(self.chunk_size, mcq["num"] - start)}))
+            else:
+                units.append((index, "lesson_plan", spec["lesson_plan"]))
+        now = time.time()
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.execute("INSERT INTO jobs (id, specs, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                             (job_id, json.dumps(specs), now, now))
+            self._db.executemany(
+                "INSERT INTO job_units (job_id, seq, spec, kind, params) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, seq, index, kind, json.dumps(params)) for seq, (index, kind, params) in enumerate(units)],
+            )
+        if self._wake is not None:
+            self._wake.set()
+        return job_id
+
+    def status(self, job_id: str) -> Dict[str, Any] | None:
+        """Progress of a job: unit counts by status, item count and unit errors; None if unknown."""
+        job = self._db.execute("SELECT created_at, updated_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        for state, count in self._db.execute("SELECT status, COUNT(*) FROM job_units WHERE job_id = ? GROUP BY status", (job_id,)):
+            counts[state] = count
+        errors = [
+            {"spec": spec, "error": error}
+            for spec, error in self._db.execute(
+                "SELECT spec, error FROM job_units WHERE job_id = ? AND status = 'failed' ORDER BY seq", (job_id,)
+            )
+        ]
+        (items,) = self._db.execute("SELECT COUNT(*) FROM job_items WHERE job_id = ?", (job_id,)).fetchone()
+        if counts["queued"] + counts["running"]:
+            state = "running" if counts["running"] or counts["done"] or counts["failed"] else "queued"
+        else:
+            state = "failed" if counts["failed"] and not counts["done"] else "done"
+        return {
+            "job_id": job_id,
+            "status": state,
+            "units": counts,
+            "items": items,
+            "errors": errors,
+            "created_at": job[0],
+            "updated_at": job[1],
         }
 
+    def results(self, job_id: str, offset: int, limit: int) -> list[dict]:
+        """
+        One page of a job's items, in the order they were finished. Items are
+        only ever appended to that order, so offsets stay valid while the job runs.
+        """
+        return [
+            json.loads(payload)
+            for (payload,) in self._db.execute(
+                # rowid grows with every insert, so it is the completion order
+                "SELECT payload FROM job_items WHERE job_id = ? ORDER BY rowid LIMIT ? OFFSET ?",
+                (job_id, limit, offset),
+            )
+        ]
+
+    def start(self) -> None:
+        """Requeue units whose process died, drop expired jobs, and start the workers."""
+        if self._tasks:
+            return
+        with self._db:
+            self._db.execute("BEGIN")
+            # Units another live process is running keep their lease
+            self._db.execute(
+                "UPDATE job_units SET status = 'queued', owner = NULL, lease_until = NULL"
+                " WHERE status = 'running' AND COALESCE(lease_until, 0) < ?",
+                (time.time(),),
+            )
+            expired = [
+                row[0] for row in self._db.execute(
+                    "SELECT id FROM jobs WHERE updated_at < ? AND NOT EXISTS "
+                    "(SELECT 1 FROM job_units WHERE job_id = jobs.id AND status IN ('queued', 'running'))",
+                    (time.time() - self.retention,),
+                )
+            ]
+            for table in ("job_items", "job_units"):
+                self._db.executemany(f"DELETE FROM {table} WHERE job_id = ?", [(job_id,) for job_id in expired])
+            self._db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+        self._wake = asyncio.Event()
+        self._wake.set()
+        loop = asyncio.get_running_loop()
+        # Started without the caller's context, so no request deadline applies to the workers
+        self._tasks = [loop.create_task(self._work(), context=contextvars.Context()) for _ in range(max(1, self.workers))]
+        self._renewal = loop.create_task(self._renew(), context=contextvars.Context())
+
+    async def stop(self) -> None:
+        """Cancel the workers and queue their units again for any process to pick up."""
+        for task in (*self._tasks, self._renewal):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*self._tasks, *filter(None, [self._renewal]), return_exceptions=True)
+        self._tasks = []
+        self._renewal = None
+        self._wake = None
+        self._db.execute(
+            "UPDATE job_units SET status = 'queued', owner = NULL, lease_until = NULL WHERE status = 'running' AND owner = ?",
+            (self.owner,),
+        )
+
+    def _claim(self) -> tuple | None:
+        now = time.time()
+        # A single statement, so two processes sharing the database never claim the same unit
+        rows = self._db.execute(
+            "UPDATE job_units SET status = 'running', owner = ?, lease_until = ? WHERE rowid = ("
+            " SELECT u.rowid FROM job_units u JOIN jobs j ON j.id = u.job_id"
+            " WHERE u.status = 'queued' OR (u.status = 'running' AND COALESCE(u.lease_until, 0) < ?)"
+            " ORDER BY j.created_at, u.seq LIMIT 1"
+            ") AND (status = 'queued' OR COALESCE(lease_until, 0) < ?)"
+            " RETURNING job_id, seq, spec, kind, params",
+            (self.owner, now + self.lease, now, now),
+        ).fetchall()
+        return rows[0] if rows else None
+
+    async def _renew(self) -> None:
+        """Keep extending the leases of the units this process is running."""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            self._db.execute(
+                "UPDATE job_units SET lease_until = ? WHERE status = 'running' AND owner = ?",
+                (time.time() + self.lease, self.owner),
+            )
+
+    def _finish(self, job_id: str, seq: int, status: str, items: list[dict] = (), error: str | None = None) -> None:
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT OR IGNORE INTO job_items (job_id, seq, position, payload) VALUES (?, ?, ?, ?)",
+                [(job_id, seq, position, json.dumps(item)) for position, item in enumerate(items)],
+            )
+            self._db.execute(
+                "UPDATE job_units SET status = ?, error = ?, attempts = attempts + ? WHERE job_id = ? AND seq = ?",
+                (status, error, int(status != "running"), job_id, seq),
+            )
+            self._db.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    async def _run(self, spec: int, kind: str, params: Dict[str, Any]) -> list[dict]:
+        with deadline(tool_timeout("generation_job_unit")):
+            try:
+                if kind == "mcqs":
+                    questions = await stock_mcqs(params["topic"], params["level"], params["num"])
+                    if len(questions) < params["num"]:
+                        raise UnitShortfall(f"Only {len(questions)} of {params['num']} questions generated", questions)
+                    return [{"spec": spec, "mcq": question} for question in questions]
+                key = ("lesson_plan", normalize_arg(params["topic"]), normalize_arg(params["grade_level"]), params["duration"])
+                create = create_sectioned_lesson_plan if params["sectioned"] else create_lesson_plan
+                plan = await result_cache.get_or_compute(
+                    key,
+                    lambda: create(params["topic"], params["grade_level"], params["duration"]),
+                    cache_if=lambda plan: "error" not in plan,
+                )
+            except CircuitOpenError as e:
+                raise CircuitWait() from e
+        if "error" in plan:
+            # A template or partly generated plan is not a result; retry it, or report it failed
+            if circuit_breaker.state != "closed":
+                raise CircuitWait()
+            raise RuntimeError(plan["error"])
+        return [{"spec": spec, "lesson_plan": plan}]
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                unit = self._claim()
+            except sqlite3.OperationalError:
+                # Another process holds the write lock or changed the queue under us
+                await asyncio.sleep(0.1)
+                continue
+            if unit is None:
+                self._wake.clear()
+                try:
+                    # Also look again now and then for units other processes queued or abandoned
+                    await asyncio.wait_for(self._wake.wait(), self.lease / 3)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            job_id, seq, spec, kind, params = unit
+            params = json.loads(params)
+            try:
+                items = await self._run(spec, kind, params)
+            except CircuitWait:
+                # Gemini is down: queue the unit again once it recovers, without spending an attempt
+                await circuit_breaker.recovered()
+                self._db.execute("UPDATE job_units SET status = 'queued' WHERE job_id = ? AND seq = ?", (job_id, seq))
+                self._wake.set()
+                continue
+            except Exception as e:
+                (attempts,) = self._db.execute(
+                    "SELECT attempts FROM job_units WHERE job_id = ? AND seq = ?", (job_id, seq)
+                ).fetchone()
+                partial = e.questions if isinstance(e, UnitShortfall) else []
+                if attempts + 1 < self.attempts:
+                    if partial:
+                        # The retry takes these from the bank again and only generates the rest
+                        question_bank.restock(params["topic"], params["level"], partial)
+                    self._finish(job_id, seq, "queued", error=str(e))
+                    self._wake.set()
+                else:
+                    # Keep what a short unit did produce; the shortfall is reported in the job's errors
+                    self._finish(job_id, seq, "failed", [{"spec": spec, "mcq": question} for question in partial], str(e))
+                    self.failed_units += 1
+                continue
+            self._finish(job_id, seq, "done", items)
+            self.completed_units += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and unit counters for the metrics tool."""
+        counts = dict(self._db.execute("SELECT status, COUNT(*) FROM job_units GROUP BY status").fetchall())
+        return {
+            "workers": len(self._tasks),
+            "queued_units": counts.get("queued", 0),
+            "running_units": counts.get("running", 0),
+            "completed_units": self.completed_units,
+            "failed_units": self.failed_units,
+        }
+
+job_queue = JobQueue(
+    os.getenv("EDUCHAIN_JOBS_PATH")
+    or os.path.join(os.path.dirname(os.path.abspath(__file__)), "generation_jobs.sqlite3"),
+    workers=int(os.getenv("EDUCHAIN_JOB_WORKERS", "4")),
+    chunk_size=int(os.getenv("EDUCHAIN_JOB_CHUNK_SIZE", "25")),
+)
+
+@mcp.tool()
+def submit_generation_job(
+    mcqs: list[MCQSpec] | None = None, lesson_plans: list[LessonPlanSpec] | None = None
+) -> Dict[str, Any]:
+    """
+    Queue bulk work that is too large for one tool call, e.g. 200 MCQs or a
+    term's worth of lesson plans, and return at once with a job id. The job
+    runs in the background and survives the end of this session; poll it with
+    get_job_status and fetch its results with get_job_result.
+    """
+    mcqs, lesson_plans = mcqs or [], lesson_plans or []
+    if not mcqs and not lesson_plans:
+        return {"error": "A generation job needs at least one MCQ or lesson plan spec"}
+    if any(spec.num < 1 for spec in mcqs):
+        return {"error": "Every MCQ spec needs num >= 1"}
+    return job_queue.status(job_queue.submit(mcqs, lesson_plans))
+
 @mcp.tool()
-def generate_flashcards(topic: str, level: str = "Beginner", num: int = 5) -> list[dict]:
-    mcqs = generate_mcqs(topic, level, num)
-    return [{"question": q["question"], "answer": q["answer"]} for q in mcqs]
+def get_job_status(job_id: str) -> Dict[str, Any]:
+    """
+    Report a generation job's progress: "queued", "running", "done" or
+    "failed", unit counts by state, the number of result items so far, and
+    the error of every spec part that failed.
+    """
+    return job_queue.status(job_id) or {"error": f"Unknown job: {job_id}"}
+
+@mcp.tool()
+def get_job_result(job_id: str, offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+    """
+    Fetch one page of a generation job's results, starting at item <offset>.
+    Items are listed in the order they finished, which may mix specs; each is
+    {"spec": <index of the submitted spec, MCQ specs first>} plus either "mcq"
+    (one question) or "lesson_plan". Pass <next_offset> back to get the next
+    page; it is null once the last finished item was returned, and later pages
+    only ever add items while the job is running.
+    """
+    status = job_queue.status(job_id)
+    if status is None:
+        return {"error": f"Unknown job: {job_id}"}
+    offset, limit = max(0, offset), min(max(1, limit), 500)
+    items = job_queue.results(job_id, offset, limit)
+    following = offset + len(items)
+    return {
+        "job_id": job_id,
+        "status": status["status"],
+        "items": items,
+        "total_items": status["items"],
+        "next_offset": following if following < status["items"] else None,
+    }
+
+@mcp.tool()
+def get_server_metrics() -> Dict[str, Any]:
+    """
+    Report internal counters (cache hits and evictions, question bank stock) for monitoring.
+    """
+    return {
+        "cache": result_cache.stats(),
+        "question_bank": question_bank.stats(),
+        "chunking": chunk_tuner.stats(),
+        "deduplication": duplicate_index.stats(),
+        "lesson_plans": lesson_plan_stats(),
+        "batching": mcq_batcher.stats(),
+        "hedging": mcq_hedger.stats(),
+        "api_keys": key_pool.stats(),
+        "circuit_breaker": circuit_breaker.stats(),
+        "jobs": job_queue.stats(),
+    }
 
 if __name__ == "__main__":
     mcp.run()
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""
+Local stand-ins for Gemini, shared by the tests and the benchmarks.
+
+GeminiStandIn answers the generateContent and streamGenerateContent REST calls
+the genai client makes, so the server can be exercised end to end without an
+API key or network access. Latency, failures, 429s and the reply text are all
+configurable while it runs.
+"""
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class GeminiStandIn:
+    """
+    Threaded HTTP server that imitates the Gemini REST API.
+
+    Args:
+        latency (float): Seconds each request takes in "healthy" mode.
+        reply (callable): Maps the prompt text to the model's response text.
+
+    Attributes:
+        mode (str): "healthy", "slow" (takes <slow_latency>) or "failing" (HTTP 503).
+        seconds_per_token (float): Extra latency per output token, ~4 characters each;
+            streamed replies pay it chunk by chunk.
+        rate_limit_every (int): Answer every n-th request with HTTP 429; 0 never does.
+        requests, connections, rate_limited, max_in_flight: Counters for assertions.
+        last_request (dict): JSON body of the most recent request.
+    """
+
+    def __init__(self, latency: float = 0.0, reply: Callable[[str], str] | None = None):
+        self.latency = latency
+        self.reply = reply or (lambda prompt: '{"ok": true}')
+        self.mode = "healthy"
+        self.slow_latency = 2.0
+        self.seconds_per_token = 0.0
+        self.rate_limit_every = 0
+        self.requests = 0
+        self.connections = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.last_request: dict = {}
+        self._lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                with standin._lock:
+                    standin.connections += 1
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+                prompt = "".join(part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", []))
+                standin.last_request = body
+                standin._handle(self, prompt, "streamGenerateContent" in self.path)
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 128  # the default backlog of 5 drops connections opened in a burst for a 1s retry
+
+            def handle_error(self, request, client_address):
+                if not isinstance(sys.exc_info()[1], ConnectionError):  # clients that gave up, e.g. a deadline
+                    super().handle_error(request, client_address)
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def reset(self) -> None:
+        """Back to a healthy, instant stand-in with zeroed counters."""
+        self.__dict__.update(
+            mode="healthy", latency=0.0, seconds_per_token=0.0, rate_limit_every=0, requests=0,
+            connections=0, rate_limited=0, max_in_flight=0, last_request={}, reply=lambda prompt: '{"ok": true}',
+        )
+
+    def _send(self, handler, code: int, payload: dict) -> None:
+        data = json.dumps(payload).encode()
+        handler.send_response(code)
+        handler.send_header("content-type", "application/json")
+        handler.send_header("content-length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _handle(self, handler, prompt: str, stream: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            limited = self.rate_limit_every and self.requests % self.rate_limit_every == 0
+            self.rate_limited += bool(limited)
+            mode = self.mode
+        if limited:
+            return self._send(handler, 429, {"error": {"code": 429, "message": "Resource has been exhausted", "status": "RESOURCE_EXHAUSTED"}})
+        if mode == "failing":
+            return self._send(handler, 503, {"error": {"code": 503, "message": "The model is overloaded", "status": "UNAVAILABLE"}})
+        text = self.reply(prompt)
+        tokens = max(1, len(text) // 4)
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep((self.slow_latency if mode == "slow" else self.latency) + (0 if stream else tokens * self.seconds_per_token))
+            if stream:
+                return self._stream(handler, text)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        usage = {"promptTokenCount": max(1, len(prompt) // 4), "candidatesTokenCount": tokens,
+                 "totalTokenCount": max(1, len(prompt) // 4) + tokens}
+        return self._send(handler, 200, {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}],
+            "usageMetadata": usage,
+        })
+
+    def _stream(self, handler, text: str) -> None:
+        """Send <text> as eight server-sent chunks, each after the time its tokens take to generate."""
+        handler.send_response(200)
+        handler.send_header("content-type", "text/event-stream")
+        handler.end_headers()
+        step = max(1, len(text) // 8)
+        for start in range(0, len(text), step):
+            piece = text[start:start + step]
+            time.sleep(max(1, len(piece) // 4) * self.seconds_per_token)
+            chunk = {"candidates": [{"content": {"parts": [{"text": piece}], "role": "model"}}]}
+            handler.wfile.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+            handler.wfile.flush()
+        handler.close_connection = True
+
+
+_standin: GeminiStandIn | None = None
+_retired: list = []  # key pools replaced by reset_server, kept alive until exit
+
+
+def import_server():
+    """
+    Start the shared stand-in and import the server pointed at it.
+
+    The server reads its configuration at import, so this sets the environment
+    first: the direct backend, a fake key, and throwaway bank and job databases.
+
+    Returns:
+        tuple: (server module, GeminiStandIn)
+    """
+    global _standin
+    if _standin is None:
+        _standin = GeminiStandIn()
+        scratch = tempfile.mkdtemp(prefix="educhain-test-")
+        os.environ.update(
+            GEMINI_API_KEY="test-key",
+            GEMINI_BASE_URL=_standin.base_url,
+            EDUCHAIN_BACKEND="direct",
+            EDUCHAIN_BANK_PATH=os.path.join(scratch, "question_bank.sqlite3"),
+            EDUCHAIN_JOBS_PATH=os.path.join(scratch, "generation_jobs.sqlite3"),
+        )
+        os.environ.pop("GEMINI_API_KEYS", None)
+        if ROOT not in sys.path:
+            sys.path.insert(0, ROOT)
+    import educhain_mcp_server_final as server
+    for noisy in ("httpx", "google_genai"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+    return server, _standin
+
+
+def reset_server(
+    server, max_concurrency: int = 4, rpm: int = 0, tpm: int = 0, cache_ttl: float = 3600,
+    api_keys: list[str] | None = None, **breaker,
+) -> None:
+    """
+    Give the server fresh limiter, breaker and cache state for one test.
+
+    asyncio primitives and pooled connections belong to the event loop that
+    first used them, so every asyncio.run() needs new ones. The limits apply to
+    each of <api_keys> (default: the server's own); <breaker> is passed to
+    CircuitBreaker.
+    """
+    # A collected genai client schedules its httpx close on the loop that is already gone
+    _retired.append(server.key_pool)
+    server.key_pool = server.KeyPool(
+        api_keys or server.API_KEYS, base_url=_standin.base_url, max_concurrency=max_concurrency, rpm=rpm, tpm=tpm,
+    )
+    server.circuit_breaker = server.CircuitBreaker(**breaker)
+    server.result_cache = server.ResultCache(ttl=cache_ttl)
+    server._refreshes.clear()
+    server._plan_generations.clear()
+    for outcome in server.lesson_plan_outcomes:
+        server.lesson_plan_outcomes[outcome] = 0
+    _standin.reset()
+
+
+def run_tests(namespace: dict) -> None:
+    """Run every test_* function in <namespace>, for `python tests/test_*.py`."""
+    tests = [(name, test) for name, test in namespace.items() if name.startswith("test_") and callable(test)]
+    failed = 0
+    for name, test in tests:
+        started = time.perf_counter()
+        try:
+            test()
+        except Exception as e:
+            failed += 1
+            print(f"FAIL {name}: {type(e).__name__}: {e}")
+        else:
+            print(f"ok   {name} ({time.perf_counter() - started:.2f}s)")
+    print(f"{len(tests) - failed} passed, {failed} failed")
+    sys.exit(1 if failed else 0)
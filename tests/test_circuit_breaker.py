@@ -0,0 +1,118 @@
+"""
+Circuit breaker behaviour as the stand-in model switches between healthy, slow
+and failing.
+
+A failing or slow upstream should open the breaker so calls fail fast and
+lesson plans are served stale from the cache, refreshed once it recovers.
+Waiting for a rate-limiter slot is not upstream latency, and a half-open probe
+cut short by the caller's own deadline is no verdict either way. Run with
+`python tests/test_circuit_breaker.py`.
+"""
+import asyncio
+import json
+import time
+
+from standin import import_server, reset_server, run_tests
+
+server, standin = import_server()
+
+PHASE = {"duration": "10 minutes", "activities": ["Warm-up"]}
+PLAN = {
+    "title": "Fractions", "topic": "Fractions", "grade_level": "5", "duration": "45 minutes",
+    "learning_objectives": ["Add fractions"], "materials_needed": ["Fraction strips"],
+    "lesson_structure": {phase: PHASE for phase in ("introduction", "main_content", "conclusion", "assessment")},
+    "key_concepts": ["Common denominator"], "homework_assignment": "Worksheet", "additional_resources": ["Khan Academy"],
+}
+BREAKER = dict(min_calls=3, cooldown=0.5, slow_seconds=0.3)
+
+
+async def timed_plan() -> tuple[dict, float]:
+    started = time.perf_counter()
+    plan = await server.generate_lesson_plan("Fractions", "5", 45)
+    return plan, time.perf_counter() - started
+
+
+def test_failing_upstream_serves_stale_plans_then_refreshes():
+    reset_server(server, cache_ttl=0.05, **BREAKER)
+    standin.reply = lambda prompt: json.dumps(PLAN)
+
+    async def main() -> None:
+        server.key_pool.warm_up()
+        plan, _ = await timed_plan()
+        assert plan == PLAN
+        standin.mode = "failing"
+        await asyncio.sleep(0.1)  # past the TTL
+        for _ in range(BREAKER["min_calls"]):
+            await timed_plan()
+        assert server.circuit_breaker.state == "open"
+        hits = standin.requests
+        plan, elapsed = await timed_plan()
+        assert plan.get("stale") is True and plan["title"] == PLAN["title"]
+        assert elapsed < 0.05 and standin.requests == hits, "an open breaker should not reach upstream"
+
+        standin.mode = "healthy"
+        await asyncio.sleep(BREAKER["cooldown"] + 0.3)  # the background refresh probes and closes the breaker
+        assert server.circuit_breaker.state == "closed"
+        plan, _ = await timed_plan()
+        assert plan == PLAN
+
+    asyncio.run(main())
+
+
+def test_slow_upstream_opens_the_breaker():
+    reset_server(server, **BREAKER)
+    standin.mode = "slow"
+    standin.slow_latency = 0.4
+
+    async def main() -> None:
+        server.key_pool.warm_up()
+        for _ in range(BREAKER["min_calls"]):
+            await server.get_gemini_response("slow")
+        try:
+            await server.get_gemini_response("rejected")
+        except server.CircuitOpenError:
+            return
+        raise AssertionError("expected CircuitOpenError")
+
+    asyncio.run(main())
+    assert server.circuit_breaker.stats()["opens"] == 1
+
+
+def test_queueing_for_a_slot_is_not_upstream_latency():
+    # Eight 100 ms calls through one slot: the last waits 700 ms, but none is slow upstream
+    reset_server(server, max_concurrency=1, **BREAKER)
+    standin.latency = 0.1
+
+    async def main() -> None:
+        server.key_pool.warm_up()
+        await asyncio.gather(*(server.get_gemini_response(f"prompt {i}") for i in range(8)))
+
+    asyncio.run(main())
+    assert server.circuit_breaker.stats()["state"] == "closed"
+    assert server.circuit_breaker.stats()["opens"] == 0
+
+
+def test_probe_cut_short_by_the_callers_deadline_is_no_verdict():
+    reset_server(server, **BREAKER)
+    breaker = server.circuit_breaker
+    breaker.opened_at = time.monotonic() - BREAKER["cooldown"]  # open, cooldown over
+    standin.latency = 0.2
+
+    async def main() -> None:
+        server.key_pool.warm_up()
+        try:
+            with server.deadline(0.05):
+                await server.get_gemini_response("probe")
+        except TimeoutError:
+            pass
+        else:
+            raise AssertionError("expected TimeoutError")
+        assert breaker.state == "half_open" and not breaker.probing
+        await server.get_gemini_response("next probe")
+        assert breaker.state == "closed"
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    run_tests(globals())
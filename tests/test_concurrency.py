@@ -0,0 +1,78 @@
+"""
+Concurrent tool calls against a stand-in model with artificial latency.
+
+N lesson plans requested at once should take about as long as the slowest
+call while the concurrency limit allows them all to run, and scale with
+N / limit once it does not. Run with `python tests/test_concurrency.py`.
+"""
+import asyncio
+import time
+
+from standin import import_server, reset_server, run_tests
+
+server, standin = import_server()
+
+LATENCY = 0.5
+CALLS = 8
+
+
+def concurrent_lesson_plans(max_concurrency: int) -> float:
+    """Wall-clock seconds for CALLS simultaneous generate_lesson_plan calls."""
+    reset_server(server, max_concurrency=max_concurrency)
+    standin.latency = LATENCY
+
+    async def main() -> float:
+        server.key_pool.warm_up()
+        started = time.perf_counter()
+        await asyncio.gather(*(server.generate_lesson_plan(f"Topic {i}", bypass_cache=True) for i in range(CALLS)))
+        return time.perf_counter() - started
+
+    return asyncio.run(main())
+
+
+def test_calls_overlap_up_to_the_limit():
+    elapsed = concurrent_lesson_plans(max_concurrency=CALLS)
+    print(f"     limit {CALLS}: {CALLS} calls in {elapsed:.2f}s")
+    assert elapsed < 2 * LATENCY, f"{CALLS} calls took {elapsed:.2f}s, expected about {LATENCY}s"
+    assert standin.max_in_flight == CALLS
+
+
+def test_limit_bounds_calls_in_flight():
+    elapsed = concurrent_lesson_plans(max_concurrency=2)
+    print(f"     limit 2: {CALLS} calls in {elapsed:.2f}s")
+    assert standin.max_in_flight == 2
+    assert elapsed >= (CALLS / 2) * LATENCY * 0.9
+
+
+def test_serial_baseline():
+    elapsed = concurrent_lesson_plans(max_concurrency=1)
+    print(f"     limit 1: {CALLS} calls in {elapsed:.2f}s")
+    assert elapsed >= CALLS * LATENCY * 0.9
+
+
+def test_event_loop_stays_responsive():
+    # Generation must never block the loop: 10 ms ticks scheduled while the calls are in flight stay on time
+    reset_server(server, max_concurrency=CALLS)
+    standin.latency = LATENCY
+    tick = 0.01
+
+    async def main() -> float:
+        server.key_pool.warm_up()
+        await server.generate_lesson_plan("Warm-up", bypass_cache=True)  # one-off client setup is not steady state
+        calls = asyncio.gather(*(server.generate_lesson_plan(f"Topic {i}", bypass_cache=True) for i in range(CALLS)))
+        worst = 0.0
+        while not calls.done():
+            started = time.perf_counter()
+            await asyncio.sleep(tick)
+            worst = max(worst, time.perf_counter() - started - tick)
+        await calls
+        return worst
+
+    worst = asyncio.run(main())
+    print(f"     worst loop lag {worst * 1000:.1f}ms")
+    # A blocking upstream call would stall the loop for the whole LATENCY
+    assert worst < LATENCY / 20, f"event loop blocked for {worst * 1000:.0f}ms"
+
+
+if __name__ == "__main__":
+    run_tests(globals())
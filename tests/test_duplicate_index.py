@@ -0,0 +1,55 @@
+"""
+Near-duplicate question index: what it filters and what a large topic costs.
+
+Run with `python tests/test_duplicate_index.py`.
+"""
+import random
+import time
+
+from standin import import_server, run_tests
+
+server, _ = import_server()
+
+
+class FakeBank:
+    def __init__(self, signatures: list[bytes]):
+        self._signatures = signatures
+
+    def signatures(self, topic: str, level: str) -> list[bytes]:
+        return self._signatures
+
+
+def test_rewordings_are_filtered():
+    index = server.NearDuplicateIndex(FakeBank([]))
+    questions = [
+        "What is the capital of France?",
+        "Which city is the capital of France?",
+        "What is the capital city of France?",
+        "How do plants make their food?",
+    ]
+    assert [index.admit("Geography", "Beginner", q) for q in questions] == [True, True, False, True]
+    assert index.stats()["duplicates_filtered"] == 1
+
+
+def test_banked_questions_are_loaded():
+    banked = server.minhash_signature("Which planet is known as the red planet?")
+    index = server.NearDuplicateIndex(FakeBank([banked]))
+    assert not index.admit("Space", "Beginner", "Which planet is known as the Red Planet?")
+    assert index.admit("Space", "Beginner", "How many moons does Mars have?")
+
+
+def test_large_topic_stays_compact():
+    rng = random.Random(0)
+    count = 50_000
+    signatures = [rng.randbytes(4 * server.MINHASH_PERMUTATIONS) for _ in range(count)]
+    started = time.perf_counter()
+    topic = server.TopicIndex(signatures)
+    elapsed = time.perf_counter() - started
+    size = sum(a.itemsize * len(a) for a in (topic.signatures, *topic.keys, *topic.rows))
+    print(f"     {count} questions: {size / count:.0f} bytes each, built in {elapsed:.2f}s")
+    assert size / count < 500
+    assert topic.candidates(server.band_keys(signatures[123])) == {123}
+
+
+if __name__ == "__main__":
+    run_tests(globals())
@@ -0,0 +1,90 @@
+"""
+Generation jobs shared by several server processes through one database.
+
+Every unit must be claimed by exactly one process, and a process starting up
+must only take over units whose lease has run out, not ones a live process is
+still generating. Run with `python tests/test_job_queue.py`.
+"""
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+from standin import import_server, run_tests
+
+server, standin = import_server()
+
+UNITS = 200
+
+
+def shared_path() -> str:
+    return os.path.join(tempfile.mkdtemp(prefix="educhain-jobs-"), "jobs.sqlite3")
+
+
+def submit(queue, units: int) -> str:
+    return queue.submit([], [server.LessonPlanSpec(topic=f"Topic {i}") for i in range(units)])
+
+
+def test_each_unit_is_claimed_once_across_processes():
+    path = shared_path()
+    submit(server.JobQueue(path), UNITS)
+    claimed: list[list[tuple]] = [[] for _ in range(4)]
+    ready = threading.Barrier(len(claimed))
+
+    def claim_all(into: list) -> None:
+        queue = server.JobQueue(path)  # one connection per "process"
+        ready.wait()
+        while True:
+            try:
+                unit = queue._claim()
+            except server.sqlite3.OperationalError:
+                continue
+            if unit is None:
+                return
+            into.append(unit[:2])
+
+    threads = [threading.Thread(target=claim_all, args=(into,)) for into in claimed]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    everything = [unit for into in claimed for unit in into]
+    print(f"     claims per process: {[len(into) for into in claimed]}")
+    assert len(everything) == UNITS and len(set(everything)) == UNITS
+
+
+def test_start_takes_over_only_expired_leases():
+    path = shared_path()
+    live, starting = server.JobQueue(path), server.JobQueue(path)
+    job = submit(live, 2)
+    first, second = live._claim(), live._claim()
+    live._db.execute("UPDATE job_units SET lease_until = ? WHERE job_id = ? AND seq = ?", (time.time() - 1, *second[:2]))
+
+    async def main() -> None:
+        starting.start()
+        units = dict(starting._db.execute("SELECT seq, status FROM job_units WHERE job_id = ?", (job,)).fetchall())
+        await starting.stop()
+        assert units == {first[1]: "running", second[1]: "queued"}, units
+
+    asyncio.run(main())
+
+
+def test_stop_hands_running_units_back():
+    path = shared_path()
+    queue = server.JobQueue(path)
+    job = submit(queue, 1)
+
+    async def main() -> None:
+        queue.start()
+        queue._claim()
+        await queue.stop()
+
+    asyncio.run(main())
+    (status,) = queue._db.execute("SELECT status FROM job_units WHERE job_id = ?", (job,)).fetchone()
+    assert status == "queued"
+    assert server.JobQueue(path)._claim() is not None
+
+
+if __name__ == "__main__":
+    run_tests(globals())
@@ -0,0 +1,70 @@
+"""
+clean_and_parse_json against a corpus of malformed model output.
+
+Each tests/json_repair_corpus/<case>.txt holds raw output and <case>.json the
+value it should parse to. The saved Python-literal response (res2.txt) and the
+well-formed one (res2.json) are checked too. Run with
+`python tests/test_json_repair.py`.
+"""
+import ast
+import glob
+import json
+import os
+
+from standin import ROOT, import_server, run_tests
+
+server, _ = import_server()
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "json_repair_corpus")
+
+
+def corpus():
+    """(name, raw text, expected value) for every case in the corpus."""
+    for path in sorted(glob.glob(os.path.join(CORPUS, "*.txt"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        with open(os.path.join(CORPUS, name + ".json"), encoding="utf-8") as f:
+            yield name, text, json.load(f)
+
+
+def read(name: str) -> str:
+    with open(os.path.join(ROOT, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_corpus():
+    wrong = [name for name, text, expected in corpus() if server.clean_and_parse_json(text) != expected]
+    assert not wrong, f"parsed incorrectly: {', '.join(wrong)}"
+
+
+def test_repaired_output_is_strict_json():
+    for name, text, expected in corpus():
+        assert json.loads(server.repair_json(text), strict=False) == expected, name
+
+
+def test_python_literal_response():
+    text = read("res2.txt")
+    assert server.clean_and_parse_json(text) == ast.literal_eval(text)
+
+
+def test_fenced_response_takes_fast_path():
+    text = read("res2.json")
+    assert server.clean_and_parse_json(f"Here is the plan:\n```json\n{text}\n```") == json.loads(text)
+
+
+def test_expected_dict_skips_brackets_in_prose():
+    text = 'Plan [v2], see [notes]: {"title": "Loops", "items": [1, 2]} (revised [3])'
+    assert server.clean_and_parse_json(text, expect=dict) == {"title": "Loops", "items": [1, 2]}
+
+
+def test_no_json_raises():
+    try:
+        server.clean_and_parse_json("I cannot help with that.")
+    except ValueError:
+        return
+    raise AssertionError("expected ValueError")
+
+
+if __name__ == "__main__":
+    run_tests(globals())
@@ -0,0 +1,51 @@
+"""
+Spreading model calls across several API keys against the stand-in model.
+
+Each key is allowed a fixed number of calls in flight, as its quota would, so
+a burst should finish proportionally faster with every key added and the calls
+should be shared evenly. Run with `python tests/test_key_pool.py`.
+"""
+import asyncio
+import time
+
+from standin import import_server, reset_server, run_tests
+
+server, standin = import_server()
+
+PER_KEY = 2
+LATENCY = 0.1
+CALLS = 48
+
+
+def throughput(keys: int) -> float:
+    """Calls per second for a CALLS burst spread across <keys> keys."""
+    reset_server(server, max_concurrency=PER_KEY, api_keys=[f"key-{i}" for i in range(keys)])
+    standin.latency = LATENCY
+
+    async def main() -> float:
+        server.key_pool.warm_up()
+        started = time.perf_counter()
+        await asyncio.gather(*(server.get_gemini_response(f"prompt {i}") for i in range(CALLS)))
+        return CALLS / (time.perf_counter() - started)
+
+    return asyncio.run(main())
+
+
+def test_throughput_scales_with_keys():
+    rates = {keys: throughput(keys) for keys in (1, 2, 4)}
+    print("     " + ", ".join(f"{keys} key(s): {rate:.0f} calls/s" for keys, rate in rates.items()))
+    # One key's ceiling is PER_KEY / LATENCY; allow some overhead on top of linear scaling
+    assert rates[1] <= PER_KEY / LATENCY * 1.1
+    assert rates[2] >= 1.7 * rates[1]
+    assert rates[4] >= 3.2 * rates[1]
+
+
+def test_calls_are_shared_evenly():
+    throughput(4)
+    calls = [key["calls"] for key in server.key_pool.stats()]
+    assert sum(calls) == CALLS and max(calls) - min(calls) <= PER_KEY, calls
+    assert standin.max_in_flight <= 4 * PER_KEY
+
+
+if __name__ == "__main__":
+    run_tests(globals())
@@ -0,0 +1,65 @@
+"""
+Schema-constrained lesson plans: how each kind of model output is handled.
+
+The stand-in returns a well-formed plan, a fenced plan with a trailing comma,
+and text that is not JSON at all; each should be validated, repaired or
+replaced by the template and counted in lesson_plan_stats(). Run with
+`python tests/test_lesson_plan_schema.py`.
+"""
+import asyncio
+import json
+
+from standin import import_server, reset_server, run_tests
+
+server, standin = import_server()
+
+PHASE = {"duration": "15 minutes", "activities": ["Discuss", "Practice"]}
+PLAN = {
+    "title": "Photosynthesis", "topic": "Photosynthesis", "grade_level": "Middle School", "duration": "60 minutes",
+    "learning_objectives": ["Describe photosynthesis"], "materials_needed": ["Leaves"],
+    "lesson_structure": {phase: PHASE for phase in ("introduction", "main_content", "conclusion", "assessment")},
+    "key_concepts": ["Chlorophyll"], "homework_assignment": "Label a leaf", "additional_resources": ["Textbook ch. 4"],
+}
+
+
+def lesson_plan(reply: str) -> dict:
+    reset_server(server)
+    standin.reply = lambda prompt: reply
+    return asyncio.run(server.generate_lesson_plan("Photosynthesis", bypass_cache=True))
+
+
+def test_request_carries_the_schema():
+    lesson_plan(json.dumps(PLAN))
+    config = standin.last_request["generationConfig"]
+    assert config["responseMimeType"] == "application/json"
+    assert "lesson_structure" in json.dumps(config.get("responseSchema") or config.get("responseJsonSchema"))
+
+
+def test_well_formed_output_is_structured():
+    assert lesson_plan(json.dumps(PLAN)) == PLAN
+    stats = server.lesson_plan_stats()
+    assert (stats["structured"], stats["repaired"], stats["fallback"]) == (1, 0, 0)
+
+
+def test_malformed_output_is_repaired():
+    assert lesson_plan(f"```json\n{json.dumps(PLAN)[:-1]},}}\n```") == PLAN
+    stats = server.lesson_plan_stats()
+    assert (stats["structured"], stats["repaired"], stats["fallback"]) == (0, 1, 0)
+
+
+def test_invalid_output_falls_back_to_the_template():
+    plan = lesson_plan("Sorry, I can't help with that.")
+    assert plan["error"].startswith("JSON parsing failed")
+    assert set(plan["lesson_structure"]) == set(PLAN["lesson_structure"])
+    stats = server.lesson_plan_stats()
+    assert (stats["structured"], stats["repaired"], stats["fallback"], stats["fallback_rate"]) == (0, 0, 1, 1.0)
+
+
+def test_output_missing_sections_falls_back():
+    plan = lesson_plan(json.dumps({**PLAN, "lesson_structure": {}}))
+    assert "error" in plan
+    assert server.lesson_plan_stats()["fallback"] == 1
+
+
+if __name__ == "__main__":
+    run_tests(globals())
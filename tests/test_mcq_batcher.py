@@ -0,0 +1,73 @@
+"""
+Micro-batched MCQ requests: every caller must get questions on its own topic.
+
+The stand-in answers the batched prompt with numbered sets, numbered correctly
+or not, and individual prompts with questions naming their topic. Run with
+`python tests/test_mcq_batcher.py`.
+"""
+import asyncio
+import json
+import re
+
+from standin import import_server, reset_server, run_tests
+
+server, standin = import_server()
+
+TOPICS = ["Fractions", "Volcanoes", "Photosynthesis"]
+
+
+def mcq(topic: str, i: int) -> dict:
+    return {"question": f"Question {i} about {topic}?", "answer": "A", "explanation": "Because.", "options": ["A", "B", "C", "D"]}
+
+
+def reply_with_sets(numbering):
+    """Stand-in reply that labels the batched sets with numbering(index)."""
+
+    def reply(prompt: str) -> str:
+        sets = re.findall(r"Set (\d+): (\d+) question\(s\)\. Topic: ([^.]+)\.", prompt)
+        if sets:
+            return json.dumps({"sets": [
+                {"set": numbering(int(index)), "questions": [mcq(topic, i) for i in range(int(num))]}
+                for index, num, topic in sets
+            ]})
+        topic = re.search(r"Topic: (.+)", prompt).group(1).strip()
+        num = int(re.search(r"Generate (\d+)", prompt).group(1))
+        return json.dumps({"questions": [mcq(topic, i) for i in range(num)]})
+
+    return reply
+
+
+def batch(numbering) -> list[list[dict]]:
+    reset_server(server)
+    server.mcq_batcher = batcher = server.MCQBatcher(window=0.05)
+    standin.reply = reply_with_sets(numbering)
+
+    async def main() -> list[list[dict]]:
+        server.key_pool.warm_up()
+        return await asyncio.gather(*(batcher.submit(topic, "Beginner", 2) for topic in TOPICS))
+
+    results = asyncio.run(main())
+    for topic, questions in zip(TOPICS, results):
+        assert len(questions) == 2 and all(topic in q["question"] for q in questions), (topic, questions)
+    return results
+
+
+def test_correctly_numbered_sets_are_split():
+    batch(lambda index: index)
+    stats = server.mcq_batcher.stats()
+    assert (stats["upstream_calls"], stats["batched_requests"], stats["fallbacks"]) == (1, 3, 0)
+
+
+def test_sets_numbered_from_one_fall_back():
+    batch(lambda index: index + 1)
+    stats = server.mcq_batcher.stats()
+    assert (stats["batched_requests"], stats["fallbacks"]) == (0, 3)
+
+
+def test_repeated_set_numbers_fall_back():
+    batch(lambda index: min(index, 1))
+    assert server.mcq_batcher.stats()["fallbacks"] == 3
+
+
+if __name__ == "__main__":
+    run_tests(globals())
@@ -0,0 +1,68 @@
+"""
+Adaptive rate limiting against a stand-in model that answers some calls with 429.
+
+Quota errors should be absorbed (the call is retried after a pause) while the
+concurrency limit backs off, and an RPM budget should spread a burst out
+instead of sending it all at once. Run with `python tests/test_rate_limiter.py`.
+"""
+import asyncio
+import time
+
+from standin import import_server, reset_server, run_tests
+
+server, standin = import_server()
+
+CALLS = 16
+
+
+def burst(calls: int = CALLS) -> tuple[list, float]:
+    """Results of <calls> simultaneous model calls and the seconds they took."""
+
+    async def main() -> tuple[list, float]:
+        server.key_pool.warm_up()
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(server.get_gemini_response(f"prompt {i}") for i in range(calls)), return_exceptions=True,
+        )
+        return results, time.perf_counter() - started
+
+    return asyncio.run(main())
+
+
+def test_429s_are_retried_and_shrink_the_limit():
+    reset_server(server, max_concurrency=8)
+    standin.latency = 0.1
+    standin.rate_limit_every = 4
+    results, elapsed = burst()
+    print(f"     {CALLS} calls, {standin.rate_limited} answered 429, {elapsed:.2f}s")
+    assert not [r for r in results if isinstance(r, BaseException)], results
+    assert standin.rate_limited > 0
+    limiter = server.key_pool.stats()[0]
+    assert limiter["rate_limited"] == standin.rate_limited
+    assert limiter["concurrency_limit"] < 8
+    assert server.circuit_breaker.stats()["state"] == "closed"
+
+
+def test_limit_recovers_after_healthy_calls():
+    reset_server(server, max_concurrency=8)
+    standin.latency = 0.05
+    standin.rate_limit_every = 3
+    burst(6)
+    shrunk = server.key_pool.limiters[0].limit
+    standin.rate_limit_every = 0
+    burst(CALLS)
+    assert server.key_pool.limiters[0].limit > shrunk
+
+
+def test_rpm_budget_spreads_a_burst():
+    # 120 RPM holds a 20-call burst (BURST_SECONDS worth) and then refills at 2 calls per second
+    reset_server(server, max_concurrency=32, rpm=120)
+    results, elapsed = burst(24)
+    print(f"     24 calls at 120 RPM in {elapsed:.2f}s")
+    assert not [r for r in results if isinstance(r, BaseException)], results
+    assert 1.5 <= elapsed < 4
+    assert standin.rate_limited == 0
+
+
+if __name__ == "__main__":
+    run_tests(globals())